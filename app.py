@@ -3,17 +3,35 @@
 # ----------------------------------------------------------------------------#
 
 import babel.dates
+import click
 import dateutil.parser
-from flask import (Flask, render_template, request, flash, redirect, url_for)
+from flask import (Flask, Response, render_template, request, flash, redirect, url_for, abort,
+                   jsonify, g, has_request_context, before_render_template, template_rendered)
 from flask_moment import Moment
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
-import logging
-from logging import Formatter, FileHandler
+import heapq
+import math
+import sqlite3
+import time
+import uuid
+from collections import Counter
+from sqlalchemy import DDL, event
+from sqlalchemy.ext.associationproxy import association_proxy
+from sqlalchemy.engine import Engine
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm.attributes import flag_modified
+from sqlalchemy.orm.exc import StaleDataError
 from wtforms import ValidationError
 from forms import *
-from datetime import datetime
+from datetime import date, datetime, timedelta
+from scheduling import DEFAULT_SHOW_DURATION, MAX_SHOW_DURATION, find_conflicts
+import geo
+from db_types import StringArray
+from throttling import SearchGuard, TTLCache
+from metrics import Metrics
+from structured_logging import configure_logging
+from vocabulary import registry as vocabulary_registry
 
 # ----------------------------------------------------------------------------#
 # App Config.
@@ -24,13 +42,63 @@ moment = Moment(app)
 app.config.from_object('config')
 db = SQLAlchemy(app)
 migrate = Migrate(app, db)
+metrics = Metrics(app.config['METRICS_DIR'])
+search_guard = SearchGuard(app.config['SEARCH_RATE'], app.config['SEARCH_BURST'], app.config['SEARCH_CACHE_TIMEOUT'],
+                           lambda event: metrics.inc('fyyur_search_events_total', (('event', event),)))
+
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """ Method to tune every new SQLite connection, other backends are left alone """
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for pragma, value in app.config['SQLITE_PRAGMAS'].items():
+        cursor.execute(f'PRAGMA {pragma} = {value}')
+    cursor.close()
 
 
 # ----------------------------------------------------------------------------#
 # Models.
 # ----------------------------------------------------------------------------#
-class Venue(db.Model):
+venue_genres = db.Table(
+    'venue_genres',
+    db.Column('venue_id', db.Integer, db.ForeignKey('venues.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('genre_id', db.Integer, db.ForeignKey('genres.id'), primary_key=True, index=True)
+)
+
+artist_genres = db.Table(
+    'artist_genres',
+    db.Column('artist_id', db.Integer, db.ForeignKey('artists.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('genre_id', db.Integer, db.ForeignKey('genres.id'), primary_key=True, index=True)
+)
+
+
+class GenreNames:
+    """ Genre names of a venue or artist
+
+    The join table is the source of truth. Until backfill-genres has copied a
+    row's legacy genres array into it, the array is read instead, and every
+    write goes to both so either one stays complete.
+    """
+
+    genre_names = association_proxy('genre_rows', 'name', creator=lambda name: Genre.named(name))
+
+    @property
+    def genres(self):
+        return list(self.genre_names) or list(self.genres_array or ())
+
+    @genres.setter
+    def genres(self, names):
+        self.genre_names = names
+        self.genres_array = list(names or ())
+
+
+class Venue(GenreNames, db.Model):
     __tablename__ = 'venues'
+    __table_args__ = (
+        db.Index('ix_venues_geohash', 'geohash', postgresql_ops={'geohash': 'text_pattern_ops'}),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
@@ -39,18 +107,37 @@ class Venue(db.Model):
     address = db.Column(db.String(120), nullable=False)
     phone = db.Column(db.String(120))
     image_link = db.Column(db.String(500))
-    genres = db.Column("genres", db.ARRAY(db.String()), nullable=False)
+    genres_array = db.Column("genres", StringArray())
+    genre_rows = db.relationship('Genre', secondary=venue_genres, order_by='Genre.id')
     facebook_link = db.Column(db.String(120))
     website = db.Column(db.String(250))
     seeking_talent = db.Column(db.Boolean, default=True)
     seeking_description = db.Column(db.String(250))
-    shows = db.relationship('Show', backref='venue', lazy=True)
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    geohash = db.Column(db.String(geo.GEOHASH_PRECISION))
+    deleted_at = db.Column(db.DateTime)
+    # Bumped on every update, edits made against an older version are rejected
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    # Shows are removed by the database cascade instead of being loaded one by one
+    shows = db.relationship('Show', backref='venue', lazy=True, passive_deletes=True)
+
+    __mapper_args__ = {'version_id_col': version}
 
     def __repr__(self):
         return f'<Venue {self.id} name: {self.name}>'
 
+    def geocode(self):
+        """ Method to set coordinates and geohash from the venue city and state """
+        location = geo.geocode(self.city, self.state)
+        if location is None:
+            self.latitude = self.longitude = self.geohash = None
+            return
+        self.latitude, self.longitude = location
+        self.geohash = geo.encode(self.latitude, self.longitude)
+
 
-class Artist(db.Model):
+class Artist(GenreNames, db.Model):
     __tablename__ = 'artists'
 
     id = db.Column(db.Integer, primary_key=True)
@@ -58,10 +145,15 @@ class Artist(db.Model):
     city = db.Column(db.String(120), nullable=False)
     state = db.Column(db.String(120), nullable=False)
     phone = db.Column(db.String(120))
-    genres = db.Column(db.ARRAY(db.String()), nullable=False)
+    genres_array = db.Column("genres", StringArray())
+    genre_rows = db.relationship('Genre', secondary=artist_genres, order_by='Genre.id')
     image_link = db.Column(db.String(500))
     facebook_link = db.Column(db.String(120))
-    shows = db.relationship('Show', backref='artist', lazy=True)
+    deleted_at = db.Column(db.DateTime)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    shows = db.relationship('Show', backref='artist', lazy=True, passive_deletes=True)
+
+    __mapper_args__ = {'version_id_col': version}
 
     def __repr__(self):
         return f'<Artist {self.id} name: {self.name}>'
@@ -69,15 +161,165 @@ class Artist(db.Model):
 
 class Show(db.Model):
     __tablename__ = 'shows'
+    __table_args__ = (
+        db.Index('ix_shows_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_shows_artist_id_start_time', 'artist_id', 'start_time'),
+        # Date range browsing on /shows is not tied to one venue or artist
+        db.Index('ix_shows_start_time', 'start_time'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    artist_id = db.Column(db.Integer, db.ForeignKey('artists.id'), nullable=False)
-    venue_id = db.Column(db.Integer, db.ForeignKey('venues.id'), nullable=False)
+    artist_id = db.Column(db.Integer, db.ForeignKey('artists.id', ondelete='CASCADE'), nullable=False)
+    venue_id = db.Column(db.Integer, db.ForeignKey('venues.id', ondelete='CASCADE'), nullable=False)
     start_time = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    end_time = db.Column(db.DateTime, nullable=False,
+                         default=lambda context: context.get_current_parameters()['start_time'] + DEFAULT_SHOW_DURATION)
 
     def __repr__(self):
         return f'<Show {self.id}, Artist {self.artist_id}, Venue {self.venue_id}>'
 
+    @classmethod
+    def find_conflict(cls, artist_id, venue_id, start_time, end_time):
+        """ Method to find a show double booking the venue or artist between start and end time """
+        # No show lasts longer than MAX_SHOW_DURATION, so only shows starting in (start - MAX, end) can overlap
+        # and the (venue_id / artist_id, start_time) indexes bound the scan to that range
+        return active_shows(cls.query.filter(db.or_(cls.venue_id == venue_id, cls.artist_id == artist_id),
+                                             cls.start_time > start_time - MAX_SHOW_DURATION,
+                                             cls.start_time < end_time, cls.end_time > start_time)).first()
+
+
+# Postgres enforces no double booking itself with GiST exclusion constraints over the show time range.
+# They also cover shows of deleted venues and artists until purge-deleted removes them.
+event.listen(Show.__table__, 'before_create',
+             DDL('CREATE EXTENSION IF NOT EXISTS btree_gist').execute_if(dialect='postgresql'))
+for resource in ('venue_id', 'artist_id'):
+    event.listen(Show.__table__, 'after_create', DDL(
+        f'ALTER TABLE shows ADD CONSTRAINT shows_{resource}_no_overlap '
+        f'EXCLUDE USING gist ({resource} WITH =, tsrange(start_time, end_time) WITH &&)'
+    ).execute_if(dialect='postgresql'))
+
+
+class VenueSimilarity(db.Model):
+    __tablename__ = 'venue_similarities'
+
+    venue_id = db.Column(db.Integer, db.ForeignKey('venues.id', ondelete='CASCADE'), primary_key=True)
+    similar_venue_id = db.Column(db.Integer, db.ForeignKey('venues.id', ondelete='CASCADE'), primary_key=True)
+    score = db.Column(db.Float, nullable=False)
+    similar_venue = db.relationship('Venue', foreign_keys=[similar_venue_id])
+
+
+class ArtistSimilarity(db.Model):
+    __tablename__ = 'artist_similarities'
+
+    artist_id = db.Column(db.Integer, db.ForeignKey('artists.id', ondelete='CASCADE'), primary_key=True)
+    similar_artist_id = db.Column(db.Integer, db.ForeignKey('artists.id', ondelete='CASCADE'), primary_key=True)
+    score = db.Column(db.Float, nullable=False)
+    similar_artist = db.relationship('Artist', foreign_keys=[similar_artist_id])
+
+
+class RecommendedVersion(db.Model):
+    __tablename__ = 'recommended_versions'
+
+    # What a venue or artist looked like when its neighbours were last computed: its row version, and the
+    # number and id sum of its active shows. Any difference means its genres or co-bookings changed since.
+    kind = db.Column(db.String(20), primary_key=True)
+    entity_id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False)
+    show_count = db.Column(db.Integer, nullable=False)
+    show_id_sum = db.Column(db.BigInteger, nullable=False)
+
+
+class Watermark(db.Model):
+    __tablename__ = 'watermarks'
+
+    name = db.Column(db.String(120), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+    @classmethod
+    def get(cls, name):
+        watermark = cls.query.get(name)
+        return watermark.value if watermark is not None else 0
+
+    @classmethod
+    def set(cls, name, value):
+        db.session.merge(cls(name=name, value=value))
+
+
+class ShowRollup(db.Model):
+    __tablename__ = 'show_rollups'
+    __table_args__ = (
+        db.Index('ix_show_rollups_dimension_day', 'dimension', 'day'),
+    )
+
+    day = db.Column(db.Date, primary_key=True)
+    # venue, artist, city or genre; key is the venue id, artist id, "city, state" or genre name
+    dimension = db.Column(db.String(20), primary_key=True)
+    key = db.Column(db.String(250), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ShowRollupTotal(db.Model):
+    __tablename__ = 'show_rollup_totals'
+    __table_args__ = (
+        db.Index('ix_show_rollup_totals_dimension_count', 'dimension', 'count'),
+    )
+
+    # Daily rollups summed from the day in the 'rollup_window' watermark onwards, so rankings read one row per key
+    dimension = db.Column(db.String(20), primary_key=True)
+    key = db.Column(db.String(250), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class RolledUpShow(db.Model):
+    __tablename__ = 'rolled_up_shows'
+
+    # The rollup rows each counted show added one to, so purging it subtracts exactly those
+    show_id = db.Column(db.Integer, db.ForeignKey('shows.id', ondelete='CASCADE'), primary_key=True)
+    dimension = db.Column(db.String(20), primary_key=True)
+    key = db.Column(db.String(250), primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+
+
+class IdempotencyKey(db.Model):
+    __tablename__ = 'idempotency_keys'
+
+    key = db.Column(db.String(64), primary_key=True)
+    endpoint = db.Column(db.String(120), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+
+class Genre(db.Model):
+    __tablename__ = 'genres'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), nullable=False, unique=True)
+
+    @classmethod
+    def named(cls, name):
+        """ Method to return the genre with this name, creating it if needed """
+        return cls.query.filter_by(name=name).first() or cls(name=name)
+
+
+class State(db.Model):
+    __tablename__ = 'states'
+
+    code = db.Column(db.String(2), primary_key=True)
+
+
+# Forms read the state and genre lists from a cache that reloads when the 'vocabulary' watermark is bumped
+vocabulary_registry.init_app(
+    app,
+    lambda: ([state.code for state in State.query.order_by(State.code)],
+             [genre.name for genre in Genre.query.order_by(Genre.id)]),
+    lambda: Watermark.get('vocabulary')
+)
+
+
+# The in memory test database starts empty on every run
+if app.config['DATABASE_PROFILE'] == 'test':
+    with app.app_context():
+        db.create_all()
+
 
 # ----------------------------------------------------------------------------#
 # Filters.
@@ -94,10 +336,135 @@ def format_datetime(value, date_format='medium'):
 app.jinja_env.filters['datetime'] = format_datetime
 
 
+# ----------------------------------------------------------------------------#
+# Instrumentation.
+# ----------------------------------------------------------------------------#
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+    g.query_count = 0
+    metrics.inc('fyyur_requests_in_flight', kind='gauge')
+
+
+@app.after_request
+def record_request(response):
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    labels = (('route', route), ('method', request.method))
+    metrics.inc('fyyur_requests_total', labels + (('status', str(response.status_code)),))
+    duration = time.perf_counter() - g.request_start
+    metrics.observe('fyyur_request_duration_seconds', labels, duration)
+
+    # The development server already prints an access line per request
+    if not app.debug:
+        app.logger.info('%s %s %s', request.method, request.path, response.status_code, extra={
+            "route": route,
+            "method": request.method,
+            "status": response.status_code,
+            "duration_ms": round(duration * 1000, 3),
+            "query_count": g.query_count
+        })
+    response.headers['X-Request-ID'] = g.request_id
+    return response
+
+
+@app.teardown_request
+def finish_request(error=None):
+    metrics.inc('fyyur_requests_in_flight', value=-1, kind='gauge')
+    metrics.dump()
+
+
+def start_template_timer(sender, template, context, **extra):
+    g.template_start = time.perf_counter()
+
+
+def record_template(sender, template, context, **extra):
+    metrics.observe('fyyur_template_render_seconds', (('template', template.name),),
+                    time.perf_counter() - g.template_start)
+
+
+before_render_template.connect(start_template_timer, app)
+template_rendered.connect(record_template, app)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_query(conn, cursor, statement, parameters, context, executemany):
+    metrics.observe('fyyur_db_query_seconds', (), time.perf_counter() - conn.info['query_start'].pop())
+    if has_request_context():
+        g.query_count = g.get('query_count', 0) + 1
+
+
+@metrics.gauge
+def pool_gauges():
+    pool = db.engine.pool
+    return {
+        ('fyyur_db_pool_checked_out', ()): pool.checkedout() if hasattr(pool, 'checkedout') else 0,
+        ('fyyur_db_pool_size', ()): pool.size() if hasattr(pool, 'size') else 0
+    }
+
+
 # ----------------------------------------------------------------------------#
 # Controllers.
 # ----------------------------------------------------------------------------#
 
+def get_active_or_404(model, entity_id):
+    """ Method to load a venue or artist that has not been deleted """
+    entity = model.query.get(entity_id)
+    if entity is None or entity.deleted_at is not None:
+        abort(404)
+    return entity
+
+
+def is_active(model, entity_id):
+    """ Method to check that a venue or artist exists and has not been deleted """
+    return db.session.query(model.id).filter(model.id == entity_id, model.deleted_at.is_(None)).first() is not None
+
+
+def active_shows(query):
+    """ Method to restrict a show query to shows whose venue and artist have not been deleted """
+    return query.join(Venue, Show.venue_id == Venue.id).join(Artist, Show.artist_id == Artist.id) \
+        .filter(Venue.deleted_at.is_(None), Artist.deleted_at.is_(None))
+
+
+def new_idempotency_key():
+    """ Method to generate the key a create form sends back with its submission """
+    return uuid.uuid4().hex
+
+
+def submission_key():
+    return request.headers.get('Idempotency-Key') or request.form.get('idempotency_key') or None
+
+
+def already_submitted(key):
+    """ Method to check whether a submission with this key was saved before, reserving the key if not
+
+    The key row commits in the same transaction as the new record, so of two
+    concurrent submissions with one key only the first commit succeeds.
+    """
+    if key is None:
+        return False
+    if IdempotencyKey.query.get(key) is not None:
+        return True
+    db.session.add(IdempotencyKey(key=key, endpoint=request.endpoint))
+    return False
+
+
+def lost_submission_race(key):
+    """ Method to check, after a failed commit, whether a concurrent submission with the same key was saved """
+    return key is not None and IdempotencyKey.query.get(key) is not None
+
+
+def version_matches(entity):
+    """ Method to compare the version an edit form was loaded with to the current one, a missing version never matches """
+    return request.form.get('version', type=int) == entity.version
+
+
 @app.route('/')
 def index():
     return render_template('pages/home.html')
@@ -112,7 +479,7 @@ def venues():
 
     data = []
     unique_locations = set()
-    all_venues = Venue.query.all()
+    all_venues = Venue.query.filter(Venue.deleted_at.is_(None)).all()
 
     # Search for only unique venues
     for venue in all_venues:
@@ -128,7 +495,7 @@ def venues():
     for venue in all_venues:
         num_upcoming_shows = 0
 
-        all_shows = Show.query.filter_by(venue_id=venue.id).all()
+        all_shows = active_shows(Show.query.filter_by(venue_id=venue.id)).all()
 
         current_date = datetime.now()
 
@@ -149,36 +516,115 @@ def venues():
     return render_template('pages/venues.html', areas=data)
 
 
+def search_results(model, search_term):
+    """ Method to run a case insensitive name search, rate limited per client and shared between identical searches """
+    if not search_guard.allow(request.remote_addr):
+        abort(429)
+
+    # The same normalised term is the cache key and the query, so one key never stands for different results
+    term = search_term.strip().lower()
+
+    def load():
+        matches = model.query.filter(model.name.ilike(f'%{term}%'), model.deleted_at.is_(None)).with_entities(model.id, model.name).all()
+        return {
+            "count": len(matches),
+            "data": [{"id": match.id, "name": match.name} for match in matches]
+        }
+
+    return search_guard.search((model.__tablename__, term), load)
+
+
 @app.route('/venues/search', methods=['POST'])
 def search_venues():
     """ Method to search venues based on user input term """
     search_term = request.form.get('search_term', '')
-    data = Venue.query.filter(Venue.name.ilike(f'%{search_term}%'))
 
     # Search for venue depending on criteria
-    results = {
-        "count": data.count(),
-        "data": data
-    }
+    results = search_results(Venue, search_term)
     return render_template('pages/search_venues.html', results=results, search_term=search_term)
 
 
+@app.route('/search/stats')
+def search_stats():
+    """ Method to report rate limiting, coalescing and cache counters for the search endpoints """
+    return jsonify({dict(labels)['event']: int(value) for (name, labels), value in metrics.collect().items()
+                    if name == 'fyyur_search_events_total'})
+
+
+def near_candidates(latitude, longitude, radius):
+    """ Method to load the venues inside the bounding box of a circle, found by index range scans on geohash cells """
+    south, north, west, east = geo.bounding_box(latitude, longitude, radius)
+    longitude_bounds = Venue.longitude.between(west, east) if west <= east \
+        else db.or_(Venue.longitude >= west, Venue.longitude <= east)
+    prefixes = geo.covering_prefixes(latitude, longitude, radius)
+    return Venue.query.filter(db.or_(*[Venue.geohash.like(prefix + '%') for prefix in prefixes]),
+                              Venue.latitude.between(south, north), longitude_bounds, Venue.deleted_at.is_(None)) \
+        .with_entities(Venue.id, Venue.name, Venue.city, Venue.state, Venue.latitude, Venue.longitude).all()
+
+
+@app.route('/venues/near')
+def venues_near():
+    """ Method to list the nearest venues within a radius (km) of a point """
+    try:
+        latitude = float(request.args['lat'])
+        longitude = float(request.args['lng'])
+        radius = min(float(request.args.get('radius', app.config['NEAR_DEFAULT_RADIUS'])),
+                     app.config['NEAR_MAX_RADIUS'])
+    except (KeyError, ValueError):
+        abort(400)
+    # float() also accepts nan and inf, which would break the geohash cell math
+    if not (math.isfinite(latitude) and math.isfinite(longitude) and math.isfinite(radius)) \
+            or not -90 <= latitude <= 90 or not -180 <= longitude <= 180 or radius < 0:
+        abort(400)
+
+    # Nearest venues of a dense area all lie within a small radius, so the search starts there and doubles
+    # it up to the requested one until enough venues are found; each round reads only the venues in its box
+    max_results = app.config['NEAR_MAX_RESULTS']
+    search_radius = min(app.config['NEAR_INITIAL_RADIUS'], radius)
+    while True:
+        nearby = []
+        for venue in near_candidates(latitude, longitude, search_radius):
+            distance = geo.distance_km(latitude, longitude, venue.latitude, venue.longitude)
+            if distance <= search_radius:
+                nearby.append((distance, venue))
+        if len(nearby) >= max_results or search_radius >= radius:
+            break
+        search_radius = min(search_radius * 2, radius)
+    nearby = heapq.nsmallest(max_results, nearby, key=lambda pair: (pair[0], pair[1].id))
+
+    # Upcoming show counts for all results in one grouped query
+    upcoming = dict(active_shows(db.session.query(Show.venue_id, db.func.count(Show.id)).filter(
+        Show.venue_id.in_([venue.id for _, venue in nearby]), Show.start_time > datetime.now()
+    )).group_by(Show.venue_id).all()) if nearby else {}
+
+    data = [{
+        "id": venue.id,
+        "name": venue.name,
+        "city": venue.city,
+        "state": venue.state,
+        "distance": round(distance, 1),
+        "num_upcoming_shows": upcoming.get(venue.id, 0)
+    } for distance, venue in nearby]
+
+    return render_template('pages/venues_near.html', venues=data, radius=radius)
+
+
 @app.route('/venues/<int:venue_id>')
 def show_venue(venue_id):
     """ Method to display individual venues based on user venue_id """
     # Shows the venue page with the given venue_id
-    venue = Venue.query.get(venue_id)
+    venue = get_active_or_404(Venue, venue_id)
 
     current_time = datetime.now()
 
     # Search for upcoming shows
-    upcoming_shows_query = db.session.query(Show).join(Venue, Show.venue_id == venue.id).filter(
-        Show.start_time > current_time).all()
+    upcoming_shows_query = active_shows(Show.query.filter(Show.venue_id == venue.id,
+                                                          Show.start_time > current_time)).all()
     upcoming_shows = []
 
     # Search for past shows
-    past_shows_query = db.session.query(Show).join(Venue, Show.venue_id == venue.id).filter(
-        Show.start_time < current_time).all()
+    past_shows_query = active_shows(Show.query.filter(Show.venue_id == venue.id,
+                                                      Show.start_time < current_time)).all()
     past_shows = []
 
     # Search for upcoming and previous shows
@@ -200,6 +646,11 @@ def show_venue(venue_id):
         }
         past_shows.append(data)
 
+    # Precomputed by the refresh-recommendations command, venues deleted since the last run are skipped
+    similar_venues = VenueSimilarity.query.join(VenueSimilarity.similar_venue) \
+        .filter(VenueSimilarity.venue_id == venue.id, Venue.deleted_at.is_(None)) \
+        .options(db.contains_eager(VenueSimilarity.similar_venue)).order_by(db.desc(VenueSimilarity.score)).all()
+
     # Display past and upcoming shows per venue
     data = {
         "id": venue.id,
@@ -217,7 +668,12 @@ def show_venue(venue_id):
         "past_shows": past_shows,
         "upcoming_shows": upcoming_shows,
         "past_shows_count": len(past_shows),
-        "upcoming_shows_count": len(upcoming_shows)
+        "upcoming_shows_count": len(upcoming_shows),
+        "similar_venues": [{
+            "id": similar.similar_venue.id,
+            "name": similar.similar_venue.name,
+            "image_link": similar.similar_venue.image_link
+        } for similar in similar_venues]
     }
 
     return render_template('pages/show_venue.html', venue=data)
@@ -230,21 +686,28 @@ def show_venue(venue_id):
 def create_venue_form():
     """ Method to post venue """
     form = VenueForm()
-    return render_template('forms/new_venue.html', form=form)
+    return render_template('forms/new_venue.html', form=form, idempotency_key=new_idempotency_key())
 
 
 @app.route('/venues/create', methods=['POST'])
 def create_venue_submission():
     """ Method to save venue in database """
+    key = submission_key()
     try:
+        # A retried or double clicked submission is a no-op
+        if already_submitted(key):
+            flash('Venue ' + request.form['name'] + ' was already listed.')
+            return render_template('pages/home.html')
+
         # get form data and create
         form = VenueForm()
         venue = Venue(name=form.name.data, city=form.city.data, state=form.state.data, address=form.address.data,
                       phone=form.phone.data, image_link=form.image_link.data, facebook_link=form.facebook_link.data,
                       seeking_description=form.seeking_description.data, seeking_talent=form.seeking_talent.data,
                       website=form.website.data, genres=form.genres.data)
+        venue.geocode()
 
-        if not form.validate_phone(venue.phone):
+        if not form.validate_phone(venue.phone) or not form.genres_in_vocabulary():
             db.session.rollback()
             flash('An error occurred. Venue ' + request.form['name'] + ' could not be listed.')
             # closes session
@@ -254,13 +717,17 @@ def create_venue_submission():
         # commit session to database
         db.session.add(venue)
         db.session.commit()
+        search_guard.invalidate()
 
         # flash success
         flash('Venue ' + request.form['name'] + ' was successfully listed!')
     except SQLAlchemyError:
         # catches errors
         db.session.rollback()
-        flash('An error occurred. Venue ' + request.form['name'] + ' could not be listed.')
+        if lost_submission_race(key):
+            flash('Venue ' + request.form['name'] + ' was already listed.')
+        else:
+            flash('An error occurred. Venue ' + request.form['name'] + ' could not be listed.')
     finally:
         # closes session
         db.session.close()
@@ -276,8 +743,10 @@ def delete_venue(venue_id):
         venue = Venue.query.get(venue_id)
         venue_name = venue.name
 
-        db.session.delete(venue)
+        # Hidden right away, the purge-deleted command removes it and its shows in batches
+        venue.deleted_at = datetime.utcnow()
         db.session.commit()
+        search_guard.invalidate()
 
         flash('Venue ' + venue_name + ' was deleted')
     except SQLAlchemyError:
@@ -296,7 +765,7 @@ def artists():
     """ Method to display artists """
     data = []
 
-    all_artists = Artist.query.all()
+    all_artists = Artist.query.filter(Artist.deleted_at.is_(None)).all()
 
     for artist in all_artists:
         data.append({
@@ -313,12 +782,7 @@ def search_artists():
     search_term = request.form.get('search_term', '')
 
     # filter artists by case insensitive search
-    result = Artist.query.filter(Artist.name.ilike(f'%{search_term}%'))
-
-    response = {
-        "count": result.count(),
-        "data": result
-    }
+    response = search_results(Artist, search_term)
 
     return render_template('pages/search_artists.html', results=response,
                            search_term=request.form.get('search_term', ''))
@@ -328,18 +792,18 @@ def search_artists():
 def show_artist(artist_id):
     """ Method to show individual artists based on artist id """
 
-    artist = Artist.query.get(artist_id)
+    artist = get_active_or_404(Artist, artist_id)
 
     current_time = datetime.now()
 
     # Search for upcoming shows
-    upcoming_shows_query = db.session.query(Show).join(Artist, Show.artist_id == artist.id).filter(
-        Show.start_time > current_time).all()
+    upcoming_shows_query = active_shows(Show.query.filter(Show.artist_id == artist.id,
+                                                          Show.start_time > current_time)).all()
     upcoming_shows = []
 
     # Search for past shows
-    past_shows_query = db.session.query(Show).join(Artist, Show.artist_id == artist.id).filter(
-        Show.start_time < current_time).all()
+    past_shows_query = active_shows(Show.query.filter(Show.artist_id == artist.id,
+                                                      Show.start_time < current_time)).all()
     past_shows = []
 
     # Search for upcoming and previous shows
@@ -361,6 +825,11 @@ def show_artist(artist_id):
         }
         past_shows.append(data)
 
+    # Precomputed by the refresh-recommendations command, artists deleted since the last run are skipped
+    similar_artists = ArtistSimilarity.query.join(ArtistSimilarity.similar_artist) \
+        .filter(ArtistSimilarity.artist_id == artist.id, Artist.deleted_at.is_(None)) \
+        .options(db.contains_eager(ArtistSimilarity.similar_artist)).order_by(db.desc(ArtistSimilarity.score)).all()
+
     data = {
         "id": artist.id,
         "name": artist.name,
@@ -373,7 +842,12 @@ def show_artist(artist_id):
         "past_shows": past_shows,
         "upcoming_shows": upcoming_shows,
         "past_shows_count": len(past_shows),
-        "upcoming_shows_count": len(upcoming_shows)
+        "upcoming_shows_count": len(upcoming_shows),
+        "similar_artists": [{
+            "id": similar.similar_artist.id,
+            "name": similar.similar_artist.name,
+            "image_link": similar.similar_artist.image_link
+        } for similar in similar_artists]
     }
 
     return render_template('pages/show_artist.html', artist=data)
@@ -387,7 +861,7 @@ def edit_artist(artist_id):
 
     form = ArtistForm()
 
-    artist = Artist.query.get(artist_id)
+    artist = get_active_or_404(Artist, artist_id)
 
     artist_data = {
         "id": artist.id,
@@ -397,10 +871,14 @@ def edit_artist(artist_id):
         "state": artist.state,
         "phone": artist.phone,
         "facebook_link": artist.facebook_link,
-        "image_link": artist.image_link
+        "image_link": artist.image_link,
+        "version": artist.version
     }
 
-    return render_template('forms/edit_artist.html', form=form, artist=artist_data)
+    vocabulary = vocabulary_registry.get()
+    return render_template('forms/edit_artist.html', form=form, artist=artist_data,
+                           state_options=vocabulary.render_options(vocabulary.state_options, artist.state),
+                           genre_options=vocabulary.render_options(vocabulary.genre_options, artist.genres))
 
 
 @app.route('/artists/<int:artist_id>/edit', methods=['POST'])
@@ -409,16 +887,25 @@ def edit_artist_submission(artist_id):
 
     try:
         form = ArtistForm()
-        artist = Artist.query.get(artist_id)
-        artist.name = form.name.data
-        artist.phone = form.phone.data
-        artist.state = form.state.data
-        artist.city = form.city.data
-        artist.genres = form.genres.data
-        artist.image_link = form.image_link.data
-        artist.facebook_link = form.facebook_link.data
-
-        if not form.validate_phone(artist.phone):
+        artist = get_active_or_404(Artist, artist_id)
+
+        if not version_matches(artist):
+            flash('Artist ' + artist.name + ' was changed by someone else. Please review and edit again.')
+            return redirect(url_for('edit_artist', artist_id=artist_id))
+
+        # Genre lookups would autoflush and issue a second versioned UPDATE
+        with db.session.no_autoflush:
+            artist.name = form.name.data
+            artist.phone = form.phone.data
+            artist.state = form.state.data
+            artist.city = form.city.data
+            artist.genres = form.genres.data
+            artist.image_link = form.image_link.data
+            artist.facebook_link = form.facebook_link.data
+        # Genre changes only touch the join table, this makes the update bump the version too
+        flag_modified(artist, 'name')
+
+        if not form.validate_phone(artist.phone) or not form.genres_in_vocabulary():
             db.session.rollback()
             flash('An error occurred. Artist ' + request.form['name'] + ' could not be edited.')
             # closes session
@@ -426,9 +913,14 @@ def edit_artist_submission(artist_id):
             return render_template('pages/home.html')
 
         db.session.commit()
+        search_guard.invalidate()
         flash('The Artist ' + request.form['name'] + ' has been successfully updated!')
+    except StaleDataError:
+        db.session.rollback()
+        flash('Artist was changed by someone else. Please review and edit again.')
+        return redirect(url_for('edit_artist', artist_id=artist_id))
     except SQLAlchemyError:
-        db.session.rolback()
+        db.session.rollback()
         flash('An Error has occured and the update unsuccessful')
     finally:
         db.session.close()
@@ -441,7 +933,7 @@ def edit_venue(venue_id):
     """ Method to edit individual venues based on venues id """
 
     form = VenueForm()
-    venue = Venue.query.get(venue_id)
+    venue = get_active_or_404(Venue, venue_id)
     venue = {
         "id": venue.id,
         "name": venue.name,
@@ -455,9 +947,13 @@ def edit_venue(venue_id):
         "seeking_talent": venue.seeking_talent,
         "seeking_description": venue.seeking_description,
         "image_link": venue.image_link,
+        "version": venue.version
     }
 
-    return render_template('forms/edit_venue.html', form=form, venue=venue)
+    vocabulary = vocabulary_registry.get()
+    return render_template('forms/edit_venue.html', form=form, venue=venue,
+                           state_options=vocabulary.render_options(vocabulary.state_options, venue['state']),
+                           genre_options=vocabulary.render_options(vocabulary.genre_options, venue['genres']))
 
 
 @app.route('/venues/<int:venue_id>/edit', methods=['POST'])
@@ -466,22 +962,31 @@ def edit_venue_submission(venue_id):
 
     try:
         form = VenueForm()
-        venue = Venue.query.get(venue_id)
+        venue = get_active_or_404(Venue, venue_id)
         name = form.name.data
 
-        venue.name = name
-        venue.genres = form.genres.data
-        venue.city = form.city.data
-        venue.state = form.state.data
-        venue.address = form.address.data
-        venue.phone = form.phone.data
-        venue.facebook_link = form.facebook_link.data
-        venue.website = form.website.data
-        venue.image_link = form.image_link.data
-        venue.seeking_talent = form.seeking_talent.data
-        venue.seeking_description = form.seeking_description.data
-
-        if not form.validate_phone(venue.phone):
+        if not version_matches(venue):
+            flash('Venue ' + venue.name + ' was changed by someone else. Please review and edit again.')
+            return redirect(url_for('edit_venue', venue_id=venue_id))
+
+        # Genre lookups would autoflush and issue a second versioned UPDATE
+        with db.session.no_autoflush:
+            venue.name = name
+            venue.genres = form.genres.data
+            venue.city = form.city.data
+            venue.state = form.state.data
+            venue.address = form.address.data
+            venue.phone = form.phone.data
+            venue.facebook_link = form.facebook_link.data
+            venue.website = form.website.data
+            venue.image_link = form.image_link.data
+            venue.seeking_talent = form.seeking_talent.data
+            venue.seeking_description = form.seeking_description.data
+            venue.geocode()
+        # Genre changes only touch the join table, this makes the update bump the version too
+        flag_modified(venue, 'name')
+
+        if not form.validate_phone(venue.phone) or not form.genres_in_vocabulary():
             db.session.rollback()
             flash('An error occurred. Venue ' + request.form['name'] + ' could not be edited.')
             # closes session
@@ -489,7 +994,12 @@ def edit_venue_submission(venue_id):
             return render_template('pages/home.html')
 
         db.session.commit()
+        search_guard.invalidate()
         flash('Venue ' + name + ' has been updated')
+    except StaleDataError:
+        db.session.rollback()
+        flash('Venue was changed by someone else. Please review and edit again.')
+        return redirect(url_for('edit_venue', venue_id=venue_id))
     except SQLAlchemyError:
         db.session.rollback()
         flash('An error occured while trying to update Venue')
@@ -507,21 +1017,26 @@ def create_artist_form():
     """ Method to post artists """
 
     form = ArtistForm()
-    return render_template('forms/new_artist.html', form=form)
+    return render_template('forms/new_artist.html', form=form, idempotency_key=new_idempotency_key())
 
 
 @app.route('/artists/create', methods=['POST'])
 def create_artist_submission():
     """ Method to save artists in database """
 
+    key = submission_key()
     try:
+        if already_submitted(key):
+            flash('Artist ' + request.form['name'] + ' was already listed.')
+            return render_template('pages/home.html')
+
         form = ArtistForm()
 
         artist = Artist(name=form.name.data, city=form.city.data, state=form.state.data,
                         phone=form.phone.data, genres=form.genres.data,
                         image_link=form.image_link.data, facebook_link=form.facebook_link.data)
 
-        if not form.validate_phone(artist.phone):
+        if not form.validate_phone(artist.phone) or not form.genres_in_vocabulary():
             db.session.rollback()
             flash('An error occurred. Artist ' + request.form['name'] + ' could not be created.')
             # closes session
@@ -530,11 +1045,15 @@ def create_artist_submission():
 
         db.session.add(artist)
         db.session.commit()
+        search_guard.invalidate()
 
         flash('Artist ' + request.form['name'] + ' was successfully listed!')
     except SQLAlchemyError:
         db.session.rollback()
-        flash('An error occurred. Artist ' + request.form['name'] + ' could not be listed.')
+        if lost_submission_race(key):
+            flash('Artist ' + request.form['name'] + ' was already listed.')
+        else:
+            flash('An error occurred. Artist ' + request.form['name'] + ' could not be listed.')
     finally:
         db.session.close()
 
@@ -551,8 +1070,10 @@ def delete_artist(artist_id):
         artist = Artist.query.get(artist_id)
         artist_name = artist.name
 
-        db.session.delete(artist)
+        # Hidden right away, the purge-deleted command removes it and its shows in batches
+        artist.deleted_at = datetime.utcnow()
         db.session.commit()
+        search_guard.invalidate()
 
         flash('Artist ' + artist_name + ' was deleted')
     except SQLAlchemyError:
@@ -567,15 +1088,54 @@ def delete_artist(artist_id):
 #  Shows
 #  ----------------------------------------------------------------
 
+def parse_date_arg(name):
+    """ Method to read an optional date from the query string """
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return dateutil.parser.parse(value)
+    except (ValueError, OverflowError):
+        abort(400)
+
+
+def has_genre(model, genre):
+    """ Method to match venues or artists with a genre, in the join table or in a legacy array not backfilled yet """
+    condition = model.genre_rows.any(Genre.name == genre)
+    # Rows created without the join tables only exist on Postgres
+    if db.engine.dialect.name == 'postgresql':
+        condition = db.or_(condition, model.genres_array.any(genre))
+    return condition
+
+
+def shows_in_range(query, date_from=None, date_to=None):
+    """ Method to restrict a show query to [date_from, date_to) so it runs as a range scan on start_time """
+    if date_from is not None:
+        query = query.filter(Show.start_time >= date_from)
+    if date_to is not None:
+        query = query.filter(Show.start_time < date_to)
+    return query
+
+
 @app.route('/shows')
 def shows():
-    """ Method to display shows by start time """
+    """ Method to display shows by start time, optionally filtered by date range, city and genre """
+
+    city = request.args.get('city')
+    genre = request.args.get('genre')
 
-    all_shows = Show.query.order_by(db.desc(Show.start_time))
+    # Venue and artist come back in the same query instead of one lookup per show
+    all_shows = shows_in_range(active_shows(Show.query), parse_date_arg('from'), parse_date_arg('to')) \
+        .options(db.contains_eager(Show.venue), db.contains_eager(Show.artist))
+
+    if city:
+        all_shows = all_shows.filter(Venue.city.ilike(city))
+    if genre:
+        all_shows = all_shows.filter(db.or_(has_genre(Artist, genre), has_genre(Venue, genre)))
 
     data = []
 
-    for show in all_shows:
+    for show in all_shows.order_by(db.desc(Show.start_time)):
         data.append({
             "venue_id": show.venue_id,
             "venue_name": show.venue.name,
@@ -594,30 +1154,247 @@ def create_shows():
 
     # renders form
     form = ShowForm()
-    return render_template('forms/new_show.html', form=form)
+    return render_template('forms/new_show.html', form=form, idempotency_key=new_idempotency_key())
 
 
 @app.route('/shows/create', methods=['POST'])
 def create_show_submission():
     """ Method to save shows in database """
 
+    key = submission_key()
     try:
+        if already_submitted(key):
+            flash('Show was already listed.')
+            return render_template('pages/home.html')
+
+        form = ShowForm()
+        try:
+            start_time = dateutil.parser.parse(request.form['start_time'])
+        except (ValueError, OverflowError):
+            flash('An error occurred. Show start time ' + request.form['start_time'] + ' is not a valid date.')
+            return render_template('pages/home.html')
+
+        if not form.duration.validate(form):
+            flash('An error occurred. Show duration must be between 1 and '
+                  + str(MAX_SHOW_DURATION // timedelta(minutes=1)) + ' minutes.')
+            return render_template('pages/home.html')
+        end_time = start_time + timedelta(minutes=form.duration.data)
+
+        # A show of a deleted venue or artist would never be listed and only wait to be purged
+        if not is_active(Venue, request.form['venue_id']) or not is_active(Artist, request.form['artist_id']):
+            flash('An error occurred. Show venue or artist does not exist.')
+            return render_template('pages/home.html')
+
+        conflict = Show.find_conflict(request.form['artist_id'], request.form['venue_id'], start_time, end_time)
+        if conflict is not None:
+            flash('An error occurred. Show conflicts with an existing booking at '
+                  + format_datetime(str(conflict.start_time)) + '.')
+            return render_template('pages/home.html')
+
         show = Show(artist_id=request.form['artist_id'], venue_id=request.form['venue_id'],
-                    start_time=request.form['start_time'])
+                    start_time=start_time, end_time=end_time)
 
         db.session.add(show)
         db.session.commit()
 
+        # Drop cached feeds so the new show appears in them
+        ical_cache.delete(('venue', show.venue_id))
+        ical_cache.delete(('artist', show.artist_id))
+
         flash('Show was successfully listed!')
     except SQLAlchemyError:
         db.session.rollback()
-        flash('An error occurred. Show could not be listed.')
+        if lost_submission_race(key):
+            flash('Show was already listed.')
+        else:
+            flash('An error occurred. Show could not be listed.')
     finally:
         db.session.close()
 
     return render_template('pages/home.html')
 
 
+#  Calendars
+#  ----------------------------------------------------------------
+
+CALENDAR_PERIODS = ('week', 'month')
+
+# (kind, entity id) -> rendered iCal feed
+ical_cache = TTLCache(app.config['ICAL_CACHE_TIMEOUT'], app.config['ICAL_CACHE_SIZE'])
+
+
+def period_start(period, column):
+    """ Method to truncate a timestamp to its week (from Monday) or month, date_trunc where it exists """
+    if db.engine.dialect.name == 'postgresql':
+        return db.func.date_trunc(period, column)
+    if period == 'month':
+        return db.func.strftime('%Y-%m-01 00:00:00', column)
+    return db.func.strftime('%Y-%m-%d 00:00:00', column, 'weekday 0', '-6 days')
+
+
+def calendar_data(show_filter):
+    """ Method to bucket shows by week or month for a calendar page """
+    period = request.args.get('period', 'month')
+    if period not in CALENDAR_PERIODS:
+        abort(400)
+
+    date_from = parse_date_arg('from') or datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    date_to = parse_date_arg('to') or date_from + timedelta(days=365)
+
+    # Counts are grouped in the database so only one row per bucket comes back
+    bucket = period_start(period, Show.start_time).label('bucket')
+    buckets = shows_in_range(active_shows(db.session.query(bucket, db.func.count(Show.id)).filter(show_filter)),
+                             date_from, date_to).group_by(bucket).order_by(bucket).all()
+
+    calendar_shows = shows_in_range(active_shows(Show.query.filter(show_filter)), date_from, date_to) \
+        .options(db.contains_eager(Show.venue), db.contains_eager(Show.artist)).order_by(Show.start_time).all()
+
+    return {
+        "period": period,
+        "from": date_from,
+        "to": date_to,
+        "buckets": [{"start": start, "count": count} for start, count in buckets],
+        "shows": [{
+            "venue_id": show.venue_id,
+            "venue_name": show.venue.name,
+            "artist_id": show.artist_id,
+            "artist_name": show.artist.name,
+            "start_time": format_datetime(str(show.start_time))
+        } for show in calendar_shows]
+    }
+
+
+def ical_escape(value):
+    """ Method to escape text values for iCal """
+    return (value or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def ical_feed(kind, entity_id, show_filter):
+    """ Method to render an iCal feed of upcoming shows, cached for ICAL_CACHE_TIMEOUT seconds """
+    cached = ical_cache.get((kind, entity_id))
+    if cached is not None:
+        metrics.inc('fyyur_cache_requests_total', (('cache', 'ical'), ('result', 'hit')))
+        return cached
+    metrics.inc('fyyur_cache_requests_total', (('cache', 'ical'), ('result', 'miss')))
+
+    stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+    upcoming_shows = shows_in_range(active_shows(Show.query.filter(show_filter)), datetime.now()) \
+        .options(db.contains_eager(Show.venue), db.contains_eager(Show.artist)).order_by(Show.start_time)
+
+    lines = ['BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//Fyyur//Shows//EN']
+    for show in upcoming_shows:
+        lines += [
+            'BEGIN:VEVENT',
+            f'UID:show-{show.id}@fyyur',
+            f'DTSTAMP:{stamp}',
+            f'DTSTART:{show.start_time.strftime("%Y%m%dT%H%M%S")}',
+            f'DTEND:{show.end_time.strftime("%Y%m%dT%H%M%S")}',
+            f'SUMMARY:{ical_escape(show.artist.name)} at {ical_escape(show.venue.name)}',
+            f'LOCATION:{ical_escape(", ".join([show.venue.address, show.venue.city, show.venue.state]))}',
+            'END:VEVENT'
+        ]
+    lines.append('END:VCALENDAR')
+
+    feed = '\r\n'.join(lines) + '\r\n'
+    ical_cache.set((kind, entity_id), feed)
+    return feed
+
+
+def ical_response(feed):
+    response = Response(feed, mimetype='text/calendar')
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['ICAL_CACHE_TIMEOUT']
+    return response
+
+
+@app.route('/venues/<int:venue_id>/calendar')
+def venue_calendar(venue_id):
+    """ Method to display a venue's shows bucketed by week or month """
+    venue = get_active_or_404(Venue, venue_id)
+    calendar = calendar_data(Show.venue_id == venue_id)
+    return render_template('pages/calendar.html', name=venue.name, calendar=calendar,
+                           ical_url=url_for('venue_ical', venue_id=venue_id))
+
+
+@app.route('/artists/<int:artist_id>/calendar')
+def artist_calendar(artist_id):
+    """ Method to display an artist's shows bucketed by week or month """
+    artist = get_active_or_404(Artist, artist_id)
+    calendar = calendar_data(Show.artist_id == artist_id)
+    return render_template('pages/calendar.html', name=artist.name, calendar=calendar,
+                           ical_url=url_for('artist_ical', artist_id=artist_id))
+
+
+@app.route('/venues/<int:venue_id>/shows.ics')
+def venue_ical(venue_id):
+    """ Method to export a venue's upcoming shows as an iCal feed """
+    get_active_or_404(Venue, venue_id)
+    return ical_response(ical_feed('venue', venue_id, Show.venue_id == venue_id))
+
+
+@app.route('/artists/<int:artist_id>/shows.ics')
+def artist_ical(artist_id):
+    """ Method to export an artist's upcoming shows as an iCal feed """
+    get_active_or_404(Artist, artist_id)
+    return ical_response(ical_feed('artist', artist_id, Show.artist_id == artist_id))
+
+
+#  Admin
+#  ----------------------------------------------------------------
+
+def top_rollup_keys(dimension, limit=10):
+    """ Method to return the busiest keys of a rollup dimension over the stats window, ties in key order """
+    return db.session.query(ShowRollupTotal.key, ShowRollupTotal.count) \
+        .filter(ShowRollupTotal.dimension == dimension) \
+        .order_by(db.desc(ShowRollupTotal.count), ShowRollupTotal.key).limit(limit).all()
+
+
+@app.route('/admin/stats')
+def admin_stats():
+    """ Method to display show statistics, read only from the rollup tables """
+    # The window moves on each refresh-rollups run, the totals cover shows from its first day
+    window = Watermark.get('rollup_window')
+    since = date.fromordinal(window) if window else \
+        datetime.now().date() - timedelta(days=app.config['STATS_WINDOW_DAYS'])
+
+    busiest_venues = top_rollup_keys('venue')
+    busiest_artists = top_rollup_keys('artist')
+    venue_names = dict(db.session.query(Venue.id, Venue.name).filter(
+        Venue.id.in_([int(key) for key, _ in busiest_venues])).all()) if busiest_venues else {}
+    artist_names = dict(db.session.query(Artist.id, Artist.name).filter(
+        Artist.id.in_([int(key) for key, _ in busiest_artists])).all()) if busiest_artists else {}
+
+    # Monthly totals for the busiest cities only
+    top_cities = [key for key, _ in top_rollup_keys('city')]
+    year = db.extract('year', ShowRollup.day).label('year')
+    month = db.extract('month', ShowRollup.day).label('month')
+    city_months = db.session.query(ShowRollup.key, year, month, db.func.sum(ShowRollup.count)).filter(
+        ShowRollup.dimension == 'city', ShowRollup.day >= since, ShowRollup.key.in_(top_cities)
+    ).group_by(ShowRollup.key, year, month).order_by(ShowRollup.key, year, month).all() if top_cities else []
+
+    data = {
+        "since": since,
+        "busiest_venues": [{"id": int(key), "name": venue_names.get(int(key), key), "count": count}
+                           for key, count in busiest_venues],
+        "busiest_artists": [{"id": int(key), "name": artist_names.get(int(key), key), "count": count}
+                            for key, count in busiest_artists],
+        "top_genres": [{"name": key, "count": count} for key, count in top_rollup_keys('genre')],
+        "city_months": [{"city": key, "month": f'{int(row_year)}-{int(row_month):02d}', "count": count}
+                        for key, row_year, row_month, count in city_months],
+        "refreshed_through_show": Watermark.get('rollups')
+    }
+    return render_template('pages/admin_stats.html', stats=data)
+
+
+#  Metrics
+#  ----------------------------------------------------------------
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """ Method to expose request, template, database, pool and cache metrics to Prometheus """
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
@@ -629,14 +1406,450 @@ def server_error(error):
 
 
 if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    app.logger.info('errors')
+    configure_logging(app)
+
+# ----------------------------------------------------------------------------#
+# Commands.
+# ----------------------------------------------------------------------------#
+
+@app.cli.command('create-tables')
+def create_tables():
+    """ Command to create all tables directly, for the SQLite profile and scratch databases """
+    db.create_all()
+
+
+@app.cli.command('geocode-venues')
+def geocode_venues():
+    """ Command to fill in coordinates for venues that have none """
+    last_id = 0
+    while True:
+        batch = Venue.query.filter(Venue.geohash.is_(None), Venue.id > last_id) \
+            .order_by(Venue.id).limit(app.config['BATCH_SIZE']).all()
+        if not batch:
+            break
+        for venue in batch:
+            venue.geocode()
+        last_id = batch[-1].id
+        db.session.commit()
+
+
+@app.cli.command('import-shows')
+@click.argument('csv_file', type=click.File())
+def import_shows(csv_file):
+    """ Command to book shows in bulk from a CSV file with artist_id, venue_id, start_time and duration columns
+
+    The whole file is checked for double bookings in memory, against itself and
+    against the shows already booked around it, before anything is inserted.
+    Rejected rows are reported by line number, the rest are inserted in batches.
+    """
+    import csv
+
+    shows = []
+    for line, row in enumerate(csv.DictReader(csv_file), 2):
+        try:
+            artist_id, venue_id = int(row['artist_id']), int(row['venue_id'])
+            start_time = dateutil.parser.parse(row['start_time'])
+            duration = timedelta(minutes=int(row.get('duration') or DEFAULT_SHOW_DURATION // timedelta(minutes=1)))
+        except (KeyError, TypeError, ValueError, OverflowError):
+            click.echo(f'line {line}: not a valid show')
+            continue
+        if not timedelta(minutes=1) <= duration <= MAX_SHOW_DURATION:
+            click.echo(f'line {line}: duration must be between 1 and '
+                       f'{MAX_SHOW_DURATION // timedelta(minutes=1)} minutes')
+            continue
+        shows.append((f'line {line}', artist_id, venue_id, start_time, start_time + duration))
+
+    if not shows:
+        return
+
+    def active_ids(model, ids):
+        ids = sorted(ids)
+        return {entity_id for start in range(0, len(ids), app.config['BATCH_SIZE'])
+                for (entity_id,) in db.session.query(model.id).filter(
+                    model.id.in_(ids[start:start + app.config['BATCH_SIZE']]), model.deleted_at.is_(None))}
+
+    venue_ids = active_ids(Venue, {show[2] for show in shows})
+    artist_ids = active_ids(Artist, {show[1] for show in shows})
+    for key, artist_id, venue_id, _, _ in shows:
+        if venue_id not in venue_ids or artist_id not in artist_ids:
+            click.echo(f'{key}: unknown venue or artist')
+    shows = [show for show in shows if show[2] in venue_ids and show[1] in artist_ids]
+
+    # Existing shows of the file's venues and artists that can overlap it, starting within MAX_SHOW_DURATION
+    # before its first show; a show of both a file venue and a file artist is found twice and kept once
+    existing = {}
+    if shows:
+        booked = active_shows(db.session.query(Show.id, Show.artist_id, Show.venue_id, Show.start_time,
+                                               Show.end_time)).filter(
+            Show.start_time > min(show[3] for show in shows) - MAX_SHOW_DURATION,
+            Show.start_time < max(show[4] for show in shows))
+        for column, ids in ((Show.venue_id, sorted({show[2] for show in shows})),
+                            (Show.artist_id, sorted({show[1] for show in shows}))):
+            for start in range(0, len(ids), app.config['BATCH_SIZE']):
+                for show in booked.filter(column.in_(ids[start:start + app.config['BATCH_SIZE']])):
+                    existing[show.id] = (f'show {show.id}', show.artist_id, show.venue_id, show.start_time,
+                                         show.end_time)
+
+    rejected = set()
+    for key, other, reason in find_conflicts(shows, existing.values()):
+        click.echo(f'{key}: {reason} already booked by {other}')
+        rejected.add(key)
+
+    accepted = [show for show in shows if show[0] not in rejected]
+    for start in range(0, len(accepted), app.config['BATCH_SIZE']):
+        batch = accepted[start:start + app.config['BATCH_SIZE']]
+        try:
+            db.session.bulk_insert_mappings(Show, [
+                {"artist_id": artist_id, "venue_id": venue_id, "start_time": start_time, "end_time": end_time}
+                for _, artist_id, venue_id, start_time, end_time in batch
+            ])
+            db.session.commit()
+        except SQLAlchemyError:
+            # A show booked concurrently can still trip the database constraints
+            db.session.rollback()
+            click.echo(f'{batch[0][0]} to {batch[-1][0]}: not imported, the database rejected the batch')
+            rejected.update(key for key, *_ in batch)
+
+    ical_cache.clear()
+    click.echo(f'{len(shows) - len(rejected)} shows imported, {len(rejected)} rejected')
+
+
+def genre_names_by_id(model, table, key, ids=None):
+    """ Method to map the given, or else all active, venue or artist ids to genre names, read the same way as .genres """
+    entities = db.session.query(model.id, model.genres_array)
+    links = db.session.query(table.c[key], Genre.name).join(Genre).order_by(Genre.id)
+    if ids is None:
+        entities = entities.filter(model.deleted_at.is_(None))
+    else:
+        entities = entities.filter(model.id.in_(ids))
+        links = links.filter(table.c[key].in_(ids))
+
+    legacy = dict(entities.all())
+    names = {entity_id: [] for entity_id in legacy}
+    for entity_id, name in links:
+        if entity_id in names:
+            names[entity_id].append(name)
+    return {entity_id: genres or list(legacy[entity_id] or ()) for entity_id, genres in names.items()}
+
+
+@app.cli.command('refresh-recommendations')
+@click.option('--full', is_flag=True, help='Recompute every venue and artist, not only those affected by changes.')
+def refresh_recommendations(full):
+    """ Command to precompute similar venues and artists from genres and co-bookings
+
+    A normal run recomputes the venues and artists whose version or active
+    shows differ from their recommended_versions row, which covers genre
+    edits, new entities, late committed shows and deleted partners. It also
+    recomputes every entity whose top K list such a change can alter: those
+    listing a changed one now, and those a changed one now scores at least
+    as high against as their current K-th neighbour. --full recomputes all.
+    """
+    import recommendations
+
+    bookings = active_shows(db.session.query(Show.id, Show.venue_id, Show.artist_id)).all()
+
+    for kind, model, similarity, key, similar_key, table, pairs in (
+            ('venue', Venue, VenueSimilarity, 'venue_id', 'similar_venue_id', venue_genres,
+             [(booking.venue_id, booking.artist_id, booking.id) for booking in bookings]),
+            ('artist', Artist, ArtistSimilarity, 'artist_id', 'similar_artist_id', artist_genres,
+             [(booking.artist_id, booking.venue_id, booking.id) for booking in bookings])):
+        # Versions are read before genres, so an edit in between is seen again on the next run
+        versions = dict(db.session.query(model.id, model.version).filter(model.deleted_at.is_(None)).all())
+        genres = {entity_id: names for entity_id, names in genre_names_by_id(model, table, key).items()
+                  if entity_id in versions}
+        shows = {entity_id: [0, 0] for entity_id in genres}
+        for entity_id, _, show_id in pairs:
+            if entity_id in shows:
+                shows[entity_id][0] += 1
+                shows[entity_id][1] += show_id
+        current = {entity_id: (versions[entity_id], *shows[entity_id]) for entity_id in genres}
+
+        recorded = {row.entity_id: (row.version, row.show_count, row.show_id_sum)
+                    for row in RecommendedVersion.query.filter_by(kind=kind)}
+        changed = set(current) if full else \
+            {entity_id for entity_id, state in current.items() if recorded.get(entity_id) != state}
+        removed = sorted(set(recorded) - set(current))
+        stale = sorted(changed) + removed
+
+        entity_ids = list(genres)
+        features = recommendations.build_features(entity_ids, genres,
+                                                  [(entity_id, partner_id) for entity_id, partner_id, _ in pairs
+                                                   if entity_id in genres])
+        if full:
+            targets = entity_ids
+        else:
+            affected = set(changed)
+            for start in range(0, len(stale), app.config['BATCH_SIZE']):
+                batch = stale[start:start + app.config['BATCH_SIZE']]
+                affected.update(entity_id for (entity_id,) in db.session.query(getattr(similarity, key))
+                                .filter(getattr(similarity, similar_key).in_(batch)).distinct())
+            # Score of the K-th neighbour of every entity with a full list, the others take any positive score
+            kth_scores = dict(db.session.query(getattr(similarity, key), db.func.min(similarity.score))
+                              .group_by(getattr(similarity, key))
+                              .having(db.func.count() >= recommendations.TOP_K).all())
+            affected.update(recommendations.entering_neighbours(
+                entity_ids, features, sorted(changed), [kth_scores.get(entity_id, 0) for entity_id in entity_ids]))
+            targets = sorted(entity_id for entity_id in affected if entity_id in current)
+
+        similar = recommendations.top_similar(entity_ids, features, targets)
+        # Lists of deleted entities are dropped along with the recomputed ones
+        rewritten = list(targets) + removed
+        for start in range(0, len(rewritten), app.config['BATCH_SIZE']):
+            batch = rewritten[start:start + app.config['BATCH_SIZE']]
+            similarity.query.filter(getattr(similarity, key).in_(batch)).delete(synchronize_session=False)
+            db.session.bulk_insert_mappings(similarity, [
+                {key: entity_id, similar_key: other_id, "score": score}
+                for entity_id in batch for other_id, score in similar.get(entity_id, ())
+            ])
+            db.session.commit()
+
+        # Recorded last, so an interrupted run computes the same entities again
+        for start in range(0, len(stale), app.config['BATCH_SIZE']):
+            batch = stale[start:start + app.config['BATCH_SIZE']]
+            RecommendedVersion.query.filter(RecommendedVersion.kind == kind, RecommendedVersion.entity_id.in_(batch)) \
+                .delete(synchronize_session=False)
+            db.session.bulk_insert_mappings(RecommendedVersion, [
+                {"kind": kind, "entity_id": entity_id, "version": current[entity_id][0],
+                 "show_count": current[entity_id][1], "show_id_sum": current[entity_id][2]}
+                for entity_id in batch if entity_id in current
+            ])
+            db.session.commit()
+
+
+@app.cli.command('purge-deleted')
+def purge_deleted():
+    """ Command to remove deleted venues and artists, deleting their shows in short batches
+
+    Shows already counted in the rollup tables are subtracted from the rows
+    they were counted in, in the same transaction that deletes them.
+    """
+    for model, show_key in ((Venue, Show.venue_id), (Artist, Show.artist_id)):
+        for (entity_id,) in db.session.query(model.id).filter(model.deleted_at.isnot(None)).all():
+            while True:
+                batch = [show_id for (show_id,) in db.session.query(Show.id).filter(show_key == entity_id)
+                         .limit(app.config['BATCH_SIZE']).all()]
+                if not batch:
+                    break
+                counted = db.session.query(RolledUpShow.day, RolledUpShow.dimension, RolledUpShow.key,
+                                           db.func.count()).filter(RolledUpShow.show_id.in_(batch)) \
+                    .group_by(RolledUpShow.day, RolledUpShow.dimension, RolledUpShow.key).all()
+                add_to_rollups({(day, dimension, key): count for day, dimension, key, count in counted}, sign=-1)
+                RolledUpShow.query.filter(RolledUpShow.show_id.in_(batch)).delete(synchronize_session=False)
+                Show.query.filter(Show.id.in_(batch)).delete(synchronize_session=False)
+                db.session.commit()
+
+            model.query.filter_by(id=entity_id).delete(synchronize_session=False)
+            db.session.commit()
+
+
+@app.cli.command('seed-vocabulary')
+def seed_vocabulary():
+    """ Command to fill the states and genres tables with the built in lists """
+    from vocabulary import DEFAULT_STATES, DEFAULT_GENRES
+
+    existing_states = {code for (code,) in db.session.query(State.code).all()}
+    existing_genres = {name for (name,) in db.session.query(Genre.name).all()}
+    db.session.add_all([State(code=code) for code in DEFAULT_STATES if code not in existing_states])
+    db.session.add_all([Genre(name=name) for name in DEFAULT_GENRES if name not in existing_genres])
+    Watermark.set('vocabulary', Watermark.get('vocabulary') + 1)
+    db.session.commit()
+
+
+@app.cli.command('add-genre')
+@click.argument('name')
+def add_genre(name):
+    """ Command to add a genre, forms pick it up on their next vocabulary check """
+    db.session.add(Genre(name=name))
+    Watermark.set('vocabulary', Watermark.get('vocabulary') + 1)
+    db.session.commit()
+
+
+@app.cli.command('backfill-genres')
+def backfill_genres():
+    """ Command to copy the legacy genres arrays into the genre join tables
+
+    Rows are read in id order, BATCH_SIZE at a time, each batch in its own short
+    transaction. Links that already exist are skipped, so it can be rerun or
+    resumed while the app keeps serving.
+    """
+    genre_ids = dict(db.session.query(Genre.name, Genre.id).all())
+    if not genre_ids:
+        # Forms would otherwise offer only the genres found in the arrays
+        raise click.ClickException('The genres table is empty, run `flask seed-vocabulary` first')
+    added_genres = False
+
+    for model, table, key in ((Venue, venue_genres, 'venue_id'), (Artist, artist_genres, 'artist_id')):
+        last_id = 0
+        while True:
+            batch = db.session.query(model.id, model.genres_array).filter(model.id > last_id) \
+                .order_by(model.id).limit(app.config['BATCH_SIZE']).all()
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            for name in {name for row in batch for name in row.genres_array or ()} - set(genre_ids):
+                genre = Genre(name=name)
+                db.session.add(genre)
+                db.session.flush()
+                genre_ids[name] = genre.id
+                added_genres = True
+
+            existing = set(db.session.query(table.c[key], table.c.genre_id)
+                           .filter(table.c[key].in_([row.id for row in batch])).all())
+            links = {(row.id, genre_ids[name]) for row in batch for name in row.genres_array or ()} - existing
+            if links:
+                db.session.execute(table.insert(), [{key: entity_id, "genre_id": genre_id}
+                                                    for entity_id, genre_id in links])
+            db.session.commit()
+
+    if added_genres:
+        Watermark.set('vocabulary', Watermark.get('vocabulary') + 1)
+        db.session.commit()
+
+
+def rollup_show_query():
+    return db.session.query(Show.id, Show.start_time, Show.venue_id, Show.artist_id, Venue.city, Venue.state) \
+        .join(Venue, Show.venue_id == Venue.id)
+
+
+def show_rollup_entries(shows):
+    """ Method to list the (show id, day, dimension, key) rollup rows each show counts towards """
+    artist_genre_names = genre_names_by_id(Artist, artist_genres, 'artist_id', {show.artist_id for show in shows})
+
+    entries = []
+    for show in shows:
+        day = show.start_time.date()
+        entries.append((show.id, day, 'venue', str(show.venue_id)))
+        entries.append((show.id, day, 'artist', str(show.artist_id)))
+        entries.append((show.id, day, 'city', f'{show.city}, {show.state}'))
+        for name in artist_genre_names.get(show.artist_id, ()):
+            entries.append((show.id, day, 'genre', name))
+    return entries
+
+
+# Each rollup row changes in one statement, so concurrent refreshes and purges never overwrite each other's counts
+ROLLUP_UPSERT = db.text(
+    'INSERT INTO show_rollups (day, dimension, key, count) VALUES (:day, :dimension, :key, :count) '
+    'ON CONFLICT (day, dimension, key) DO UPDATE SET count = show_rollups.count + excluded.count'
+).bindparams(db.bindparam('day', type_=db.Date))
+ROLLUP_DROP_EMPTY = db.text(
+    'DELETE FROM show_rollups WHERE day = :day AND dimension = :dimension AND key = :key AND count <= 0'
+).bindparams(db.bindparam('day', type_=db.Date))
+ROLLUP_TOTAL_UPSERT = db.text(
+    'INSERT INTO show_rollup_totals (dimension, key, count) VALUES (:dimension, :key, :count) '
+    'ON CONFLICT (dimension, key) DO UPDATE SET count = show_rollup_totals.count + excluded.count')
+ROLLUP_TOTAL_DROP_EMPTY = db.text(
+    'DELETE FROM show_rollup_totals WHERE dimension = :dimension AND key = :key AND count <= 0')
+
+
+def locked_rollup_window():
+    """ Method to return the ordinal of the first day in the rollup totals, or 0 before they are built
+
+    The watermark row stays locked until commit, so totals are never changed
+    while refresh-rollups moves the window.
+    """
+    window = Watermark.query.filter_by(name='rollup_window').with_for_update().first()
+    return window.value if window is not None else 0
+
+
+def add_to_rollup_totals(deltas):
+    """ Method to add signed counts to the rollup totals, dropping rows that reach zero """
+    changes = [{"dimension": dimension, "key": key, "count": delta}
+               for (dimension, key), delta in deltas.items() if delta]
+    if changes:
+        db.session.execute(ROLLUP_TOTAL_UPSERT, changes)
+    decreased = [change for change in changes if change["count"] < 0]
+    if decreased:
+        db.session.execute(ROLLUP_TOTAL_DROP_EMPTY, decreased)
+
+
+def add_to_rollups(counts, sign=1):
+    """ Method to add counts to the rollup rows and totals, or subtract them with sign=-1, dropping empty rows """
+    if not counts:
+        return
+    window = locked_rollup_window()
+    changes = [{"day": day, "dimension": dimension, "key": key, "count": sign * count}
+               for (day, dimension, key), count in counts.items()]
+    db.session.execute(ROLLUP_UPSERT, changes)
+    if sign < 0:
+        db.session.execute(ROLLUP_DROP_EMPTY, changes)
+
+    if window:
+        totals = Counter()
+        for (day, dimension, key), count in counts.items():
+            if day.toordinal() >= window:
+                totals[(dimension, key)] += sign * count
+        add_to_rollup_totals(totals)
+
+
+def advance_rollup_window():
+    """ Method to start the rollup totals STATS_WINDOW_DAYS ago, subtracting the days that fell out of them """
+    start = (datetime.now().date() - timedelta(days=app.config['STATS_WINDOW_DAYS'])).toordinal()
+    window = locked_rollup_window()
+    if window == start:
+        db.session.commit()
+        return
+
+    if window and window < start:
+        expired = db.session.query(ShowRollup.dimension, ShowRollup.key, db.func.sum(ShowRollup.count)).filter(
+            ShowRollup.day >= date.fromordinal(window), ShowRollup.day < date.fromordinal(start)
+        ).group_by(ShowRollup.dimension, ShowRollup.key).all()
+        add_to_rollup_totals({(dimension, key): -int(count) for dimension, key, count in expired})
+    else:
+        # First run, or a longer STATS_WINDOW_DAYS: sum the daily rows again
+        ShowRollupTotal.query.delete(synchronize_session=False)
+        daily = db.session.query(ShowRollup.dimension, ShowRollup.key, db.func.sum(ShowRollup.count)) \
+            .filter(ShowRollup.day >= date.fromordinal(start)).group_by(ShowRollup.dimension, ShowRollup.key)
+        db.session.execute(ShowRollupTotal.__table__.insert().from_select(['dimension', 'key', 'count'], daily))
+    Watermark.set('rollup_window', start)
+    db.session.commit()
+
+
+@app.cli.command('refresh-rollups')
+def refresh_rollups():
+    """ Command to add shows booked since the last run to the daily rollup tables
+
+    Show ids are taken before the inserting transaction commits, so a show can
+    become visible below the highest id already counted. Each run therefore
+    rescans the last ROLLUP_RESCAN_WINDOW ids below the watermark, skipping the
+    shows that already have rows in rolled_up_shows. Those rows record what each
+    show was counted in, for purge-deleted to subtract. Each batch, its
+    rolled_up_shows rows and the watermark commit together. The running totals
+    behind the admin rankings first drop the days that left the stats window.
+    """
+    advance_rollup_window()
+    watermark = Watermark.get('rollups')
+    last_id = max(watermark - app.config['ROLLUP_RESCAN_WINDOW'], 0)
+    while True:
+        batch = rollup_show_query().filter(Show.id > last_id, ~db.exists().where(RolledUpShow.show_id == Show.id)) \
+            .order_by(Show.id).limit(app.config['BATCH_SIZE']).all()
+        if not batch:
+            break
+
+        entries = show_rollup_entries(batch)
+        add_to_rollups(Counter((day, dimension, key) for _, day, dimension, key in entries))
+        db.session.bulk_insert_mappings(RolledUpShow, [
+            {"show_id": show_id, "day": day, "dimension": dimension, "key": key}
+            for show_id, day, dimension, key in entries])
+
+        last_id = batch[-1].id
+        watermark = max(watermark, last_id)
+        Watermark.set('rollups', watermark)
+        db.session.commit()
+
+
+@app.cli.command('purge-idempotency-keys')
+def purge_idempotency_keys():
+    """ Command to delete idempotency keys older than IDEMPOTENCY_KEY_TTL seconds, in batches """
+    cutoff = datetime.utcnow() - timedelta(seconds=app.config['IDEMPOTENCY_KEY_TTL'])
+    while True:
+        batch = [key for (key,) in db.session.query(IdempotencyKey.key).filter(IdempotencyKey.created_at < cutoff)
+                 .limit(app.config['BATCH_SIZE']).all()]
+        if not batch:
+            break
+        IdempotencyKey.query.filter(IdempotencyKey.key.in_(batch)).delete(synchronize_session=False)
+        db.session.commit()
+
 
 # ----------------------------------------------------------------------------#
 # Launch.
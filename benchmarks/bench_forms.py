@@ -0,0 +1,71 @@
+""" Benchmark of form construction, validation and edit page <option> rendering
+
+Compares a form with class level choice lists, as forms.py used to define
+them, against the registry bound forms. Run from the project root:
+
+    python benchmarks/bench_forms.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask_wtf import FlaskForm  # noqa: E402
+from wtforms import SelectField, SelectMultipleField  # noqa: E402
+from wtforms.validators import DataRequired  # noqa: E402
+
+from app import app  # noqa: E402
+from forms import VenueForm  # noqa: E402
+from vocabulary import DEFAULT_GENRES, DEFAULT_STATES, registry  # noqa: E402
+
+ROUNDS = 2000
+
+FORM_DATA = {
+    'name': 'The Musical Hop', 'city': 'San Francisco', 'state': 'CA', 'address': '1015 Folsom Street',
+    'phone': '123-123-1234', 'genres': ['Jazz', 'Reggae'], 'facebook_link': 'https://www.facebook.com/hop',
+    'website': 'https://www.themusicalhop.com',
+}
+
+
+class InlineChoicesVenueForm(VenueForm):
+    state = SelectField('state', validators=[DataRequired()], choices=[(state, state) for state in DEFAULT_STATES])
+    genres = SelectMultipleField('genres', validators=[DataRequired()],
+                                 choices=[(genre, genre) for genre in DEFAULT_GENRES])
+
+    def __init__(self, *args, **kwargs):
+        # Skips VocabularyForm's binding, so the class level choices above are the ones measured
+        FlaskForm.__init__(self, *args, **kwargs)
+
+
+def construct_and_validate(form_class):
+    # Only the choice fields: validate() trips over the validate_phone helper WTForms takes for an inline validator
+    form = form_class()
+    return form.state.validate(form) and form.genres.validate(form)
+
+
+def render_select_per_request():
+    form = InlineChoicesVenueForm()
+    form.state.data = 'CA'
+    form.genres.data = ['Jazz', 'Reggae']
+    return str(form.state()) + str(form.genres())
+
+
+def render_precomputed_options():
+    vocabulary = registry.get()
+    return (vocabulary.render_options(vocabulary.state_options, 'CA')
+            + vocabulary.render_options(vocabulary.genre_options, ['Jazz', 'Reggae']))
+
+
+def report(label, function):
+    seconds = min(timeit.repeat(function, number=ROUNDS, repeat=3)) / ROUNDS
+    print(f'{label:<40} {seconds * 1e6:10.1f} us')
+
+
+if __name__ == '__main__':
+    app.config['WTF_CSRF_ENABLED'] = False
+    with app.test_request_context('/venues/create', method='POST', data=FORM_DATA):
+        report('construct + validate, inline choices', lambda: construct_and_validate(InlineChoicesVenueForm))
+        report('construct + validate, registry', lambda: construct_and_validate(VenueForm))
+        report('edit <select>, rendered by wtforms', render_select_per_request)
+        report('edit <select>, precomputed options', render_precomputed_options)
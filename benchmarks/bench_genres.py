@@ -0,0 +1,65 @@
+""" Benchmark of genre storage and queries, legacy arrays against the join tables
+
+Run against a database that went through flask backfill-genres, so both
+layouts hold the same data. The array layout needs Postgres; on other
+backends only the join table timings are reported. From the project root:
+
+    python benchmarks/bench_genres.py [genre]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db, Genre, Venue, venue_genres, artist_genres  # noqa: E402
+
+ROUNDS = 50
+
+
+def report(label, function):
+    seconds = min(timeit.repeat(function, number=ROUNDS, repeat=3)) / ROUNDS
+    print(f'{label:<45} {seconds * 1e3:10.3f} ms')
+
+
+def array_genre_counts():
+    genre = db.func.unnest(Venue.genres_array).label('genre')
+    return db.session.query(genre, db.func.count()).group_by(genre).all()
+
+
+def join_genre_counts():
+    return db.session.query(Genre.name, db.func.count()).join(venue_genres) \
+        .group_by(Genre.name).all()
+
+
+def array_venues_with(genre):
+    return db.session.query(Venue.id).filter(Venue.genres_array.any(genre)).all()
+
+
+def join_venues_with(genre):
+    return db.session.query(venue_genres.c.venue_id).join(Genre).filter(Genre.name == genre).all()
+
+
+def storage_bytes():
+    array_bytes = db.session.query(db.func.coalesce(db.func.sum(db.func.pg_column_size(Venue.genres_array)), 0)) \
+        .scalar()
+    join_bytes = sum(db.session.query(db.func.pg_total_relation_size(table)).scalar()
+                     for table in (Genre.__tablename__, venue_genres.name, artist_genres.name))
+    return array_bytes, join_bytes
+
+
+if __name__ == '__main__':
+    genre = sys.argv[1] if len(sys.argv) > 1 else 'Jazz'
+    with app.app_context():
+        postgres = db.engine.dialect.name == 'postgresql'
+
+        if postgres:
+            array_bytes, join_bytes = storage_bytes()
+            print(f'{"venue genres arrays":<45} {array_bytes:10d} bytes')
+            print(f'{"genres + join tables, with indexes":<45} {join_bytes:10d} bytes')
+            report('venues per genre, unnest arrays', array_genre_counts)
+        report('venues per genre, join tables', join_genre_counts)
+
+        if postgres:
+            report(f'venues with {genre}, array any()', lambda: array_venues_with(genre))
+        report(f'venues with {genre}, join tables', lambda: join_venues_with(genre))
@@ -0,0 +1,103 @@
+""" Parity check: the same pages and queries against two database backends
+
+Each backend is run in a child process on a freshly created schema seeded
+with the same fixed data, then the rendered pages are compared. The target
+databases are dropped and recreated, so only point this at scratch
+databases. Runs as part of `fab check`, or from the project root:
+
+    python checks/check_parity.py [postgres URL] [sqlite URL]
+"""
+import json
+import os
+import subprocess
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DEFAULT_URLS = ['postgresql://localhost:5432/fyyur_parity', 'sqlite://']
+
+VENUES = [
+    ('The Musical Hop', 'San Francisco', 'CA', ['Jazz', 'Reggae', 'Swing']),
+    ('The Dueling Pianos Bar', 'New York', 'NY', ['Classical', 'R&B', 'Hip-Hop']),
+    ('Park Square Live Music & Coffee', 'San Francisco', 'CA', ['Rock n Roll', 'Jazz', 'Classical', 'Folk']),
+]
+ARTISTS = [
+    ('Guns N Petals', 'San Francisco', 'CA', ['Rock n Roll']),
+    ('Matt Quevedo', 'New York', 'NY', ['Jazz']),
+    ('The Wild Sax Band', 'San Francisco', 'CA', ['Jazz', 'Classical']),
+]
+SHOWS = [
+    (1, 1, datetime(2019, 5, 21, 21, 30)),
+    (2, 3, datetime(2019, 6, 15, 23)),
+    (3, 3, datetime(2035, 4, 1, 20)),
+    (3, 3, datetime(2035, 4, 8, 20)),
+    (3, 3, datetime(2035, 4, 15, 20)),
+    (1, 2, datetime(2035, 5, 2, 19)),
+]
+
+PAGES = [
+    ('GET', '/venues'), ('GET', '/artists'), ('GET', '/shows'), ('GET', '/shows?genre=Jazz'),
+    ('GET', '/shows?city=san francisco&from=2030-01-01'), ('GET', '/venues/3'), ('GET', '/artists/3'),
+    ('GET', '/venues/3/calendar?period=month&from=2035-01-01'), ('GET', '/venues/3/calendar?period=week&from=2035-01-01'),
+    ('GET', '/venues/near?lat=37.77&lng=-122.42&radius=10'), ('POST', '/venues/search'), ('POST', '/artists/search'),
+    ('GET', '/admin/stats'),
+]
+
+
+def run_backend():
+    """ Child process: seed the configured database and print every page body as JSON """
+    from app import app, db, Venue, Artist, Show
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        for name, city, state, genres in VENUES:
+            venue = Venue(name=name, city=city, state=state, address='1015 Folsom Street', genres=genres)
+            venue.geocode()
+            db.session.add(venue)
+        for name, city, state, genres in ARTISTS:
+            db.session.add(Artist(name=name, city=city, state=state, genres=genres))
+        db.session.commit()
+        db.session.add_all([Show(artist_id=artist_id, venue_id=venue_id, start_time=start_time)
+                            for artist_id, venue_id, start_time in SHOWS])
+        db.session.commit()
+
+    runner = app.test_cli_runner()
+    runner.invoke(args=['refresh-recommendations', '--full'])
+    runner.invoke(args=['refresh-rollups'])
+
+    client = app.test_client()
+    pages = {}
+    for method, path in PAGES:
+        if method == 'POST':
+            response = client.post(path, data={'search_term': 'the'})
+        else:
+            response = client.get(path)
+        pages[f'{method} {path}'] = [response.status_code, response.get_data(as_text=True)]
+    print(json.dumps(pages))
+
+
+def run_child(url):
+    # Fixed hash seed so set ordering, e.g. the city grouping on /venues, matches between children
+    env = dict(os.environ, DATABASE_URL=url, PYTHONHASHSEED='0', FYYUR_PARITY_CHILD='1')
+    output = subprocess.run([sys.executable, os.path.abspath(__file__)], env=env, check=True,
+                            stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    if os.environ.get('FYYUR_PARITY_CHILD'):
+        run_backend()
+        sys.exit(0)
+
+    first_url, second_url = (sys.argv[1:3] + DEFAULT_URLS[len(sys.argv[1:3]):])[:2]
+    first, second = run_child(first_url), run_child(second_url)
+
+    mismatches = 0
+    for page in first:
+        same = first[page] == second[page]
+        mismatches += not same
+        print(f'{"ok" if same else "DIFFERENT":<10} {page}')
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,76 @@
+""" Concurrency check for create and edit submissions
+
+Fires parallel submissions at the app and checks what reached the
+database: POSTs sharing one idempotency key must create exactly one artist,
+and parallel edits of the same version must leave exactly one applied.
+Exits non-zero when either does not hold, and runs as part of `fab check`.
+Without DATABASE_PROFILE or DATABASE_URL it uses a fresh SQLite file in the
+temp directory; the in memory test profile shares one connection between
+threads, so it cannot be used here. From the project root:
+
+    python checks/check_submissions.py [threads]
+"""
+import os
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SCRATCH_DATABASE = os.path.join(tempfile.gettempdir(), 'fyyur_check_submissions.db')
+if 'DATABASE_PROFILE' not in os.environ and 'DATABASE_URL' not in os.environ:
+    if os.path.exists(SCRATCH_DATABASE):
+        os.remove(SCRATCH_DATABASE)
+    os.environ.update(DATABASE_PROFILE='sqlite', DATABASE_URL='sqlite:///' + SCRATCH_DATABASE)
+
+from app import app, db, Artist  # noqa: E402
+
+ARTIST = {
+    'city': 'San Francisco', 'state': 'CA', 'phone': '3261235000', 'genres': ['Rock n Roll'],
+    'facebook_link': 'https://www.facebook.com/GunsNPetals', 'image_link': '',
+}
+
+
+def post(path, data):
+    with app.test_client() as client:
+        return client.post(path, data=data)
+
+
+def parallel(threads, path, payloads):
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        responses = list(pool.map(lambda payload: post(path, payload), payloads))
+    return responses, time.perf_counter() - started
+
+
+if __name__ == '__main__':
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    app.config['WTF_CSRF_ENABLED'] = False
+    with app.app_context():
+        db.create_all()
+    name = f'Concurrency {uuid.uuid4().hex[:8]}'
+
+    key = uuid.uuid4().hex
+    _, elapsed = parallel(threads, '/artists/create',
+                       [dict(ARTIST, name=name, idempotency_key=key) for _ in range(threads)])
+    with app.app_context():
+        artist = Artist.query.filter_by(name=name).first()
+        created = Artist.query.filter_by(name=name).count()
+    print(f'{threads} submissions with one idempotency key: {created} artist created ({elapsed * 1e3:.1f} ms)')
+    if created != 1:
+        sys.exit(f'FAILED: expected exactly 1 artist created, got {created}')
+    artist_id, version = artist.id, artist.version
+
+    responses, elapsed = parallel(threads, f'/artists/{artist_id}/edit',
+                                  [dict(ARTIST, name=f'{name} edit {number}', version=version)
+                                   for number in range(threads)])
+    # Applied edits redirect to the artist page, rejected ones back to the edit form
+    applied = sum(not response.headers['Location'].endswith('/edit') for response in responses)
+    with app.app_context():
+        artist = db.session.query(Artist).get(artist_id)
+        print(f'{threads} edits of version {version}: {applied} applied, {threads - applied} rejected, '
+              f'now at version {artist.version} as "{artist.name}" ({elapsed * 1e3:.1f} ms)')
+    if applied != 1:
+        sys.exit(f'FAILED: expected exactly 1 edit applied, got {applied}')
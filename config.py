@@ -8,8 +8,67 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 DEBUG = True
 
 # Connect to the database
+# DATABASE_PROFILE picks the backend: postgres (default), sqlite (file next to the app) or test (in memory SQLite).
+# DATABASE_URL overrides the URL of any profile.
+DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE', 'postgres')
+DATABASE_URLS = {
+    'postgres': 'postgresql://ajzubillaga@localhost:5432/fyyur',
+    'sqlite': 'sqlite:///' + os.path.join(basedir, 'fyyur.db'),
+    'test': 'sqlite://',
+}
+SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', DATABASE_URLS[DATABASE_PROFILE])
+SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Applied to every SQLite connection: write ahead log so readers never block the writer, memory mapped reads,
+# foreign keys for the ON DELETE CASCADE rules, and a busy timeout instead of immediate "database is locked".
+# A case sensitive LIKE can use an ordinary index, which the geohash prefix search needs; ilike() lowers both sides.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'foreign_keys': 'ON',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,
+    'case_sensitive_like': 'ON',
+}
 
-# TODO IMPLEMENT DATABASE URL
-SQLALCHEMY_DATABASE_URI = 'postgresql://ajzubillaga@localhost:5432/fyyur'
-SQLALCHEMY_TRACK_MODIFICATIONS = False
+# Seconds an iCal feed is served from cache, and how many feeds are kept
+ICAL_CACHE_TIMEOUT = 300
+ICAL_CACHE_SIZE = 1024
+
+# Venues near me search, distances in km
+NEAR_DEFAULT_RADIUS = 25
+# The search starts at this radius and doubles until it finds NEAR_MAX_RESULTS venues or reaches the requested one
+NEAR_INITIAL_RADIUS = 2
+NEAR_MAX_RADIUS = 500
+NEAR_MAX_RESULTS = 50
+
+# Rows per transaction for maintenance commands
+BATCH_SIZE = 1000
+
+# Search endpoints: requests per second and burst size per client, seconds results are cached
+SEARCH_RATE = 2
+SEARCH_BURST = 10
+SEARCH_CACHE_TIMEOUT = 30
+
+# Directory shared by all worker processes for merging /metrics, unset for a single process
+METRICS_DIR = os.environ.get('METRICS_DIR')
+
+# Logging, {pid} in LOG_FILE gives each worker process its own file
+LOG_FILE = os.environ.get('LOG_FILE', 'error-{pid}.log')
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+# Fraction of info records kept, warnings and errors are always logged
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', '1.0'))
+
+# Seconds between checks for changes to the states and genres tables
+VOCABULARY_CHECK_INTERVAL = 60
+
+# Days of history shown on the admin statistics page
+STATS_WINDOW_DAYS = 365
+# Show ids below the rollup watermark checked again on every refresh-rollups run, for inserts that committed late
+ROLLUP_RESCAN_WINDOW = 10000
+
+# Seconds create form idempotency keys are kept for detecting retried submissions
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
@@ -0,0 +1,22 @@
+from sqlalchemy import JSON, String
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.types import TypeDecorator
+
+
+class StringArray(TypeDecorator):
+    """ List of strings stored as a native ARRAY on Postgres and as JSON everywhere else
+
+    Expressions use the ARRAY comparator, so Postgres only operators such as
+    any() still build, they just cannot run on other backends.
+    """
+
+    impl = ARRAY
+    cache_ok = True
+
+    def __init__(self):
+        super().__init__(String())
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(ARRAY(String()))
+        return dialect.type_descriptor(JSON())
@@ -12,6 +12,12 @@ def test():
         abort("Aborted at user request.")
 
 
+def check(postgres_url=""):
+    local("python checks/check_submissions.py")
+    # Drops and recreates the Postgres database, fyyur_parity on localhost unless one is given
+    local("python checks/check_parity.py {}".format(postgres_url))
+
+
 def commit():
     message = input("Enter a git commit message: ")
     local("git add . && git commit -am '{}'".format(message))
@@ -23,6 +29,7 @@ def push():
 
 def prepare():
     test()
+    check()
     commit()
     push()
 
@@ -46,6 +53,7 @@ def heroku_test():
 def deploy():
     pull()
     test()
+    check()
     commit()
     heroku()
     heroku_test()
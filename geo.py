@@ -0,0 +1,122 @@
+import csv
+import math
+import os
+from functools import lru_cache
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9
+EARTH_RADIUS_KM = 6371.0088
+# Degrees of latitude on the sphere distance_km measures on
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180.0
+# Geohash cells searched per near query at most: finer cells hug the circle, but each is another index range scan
+MAX_COVERING_CELLS = 32
+
+CITIES_FILE = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'data', 'us_cities.csv')
+
+
+@lru_cache(maxsize=1)
+def city_table():
+    """ Method to load the bundled city table once, keyed by (city, state) """
+    with open(CITIES_FILE, newline='') as cities:
+        return {
+            (row['city'].strip().lower(), row['state']): (float(row['latitude']), float(row['longitude']))
+            for row in csv.DictReader(cities)
+        }
+
+
+def geocode(city, state):
+    """ Method to look up coordinates of a city offline, returns None when the city is unknown """
+    if not city or not state:
+        return None
+    return city_table().get((city.strip().lower(), state))
+
+
+def encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    """ Method to encode coordinates as a geohash """
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    bit_count = 0
+    even = True
+
+    while len(geohash) < precision:
+        # Bits alternate between longitude and latitude, starting with longitude
+        value, interval = (longitude, lng_range) if even else (latitude, lat_range)
+        middle = (interval[0] + interval[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+
+    return ''.join(geohash)
+
+
+def cell_size(precision):
+    """ Method to return the (height, width) in degrees of a geohash cell """
+    lat_bits = (precision * 5) // 2
+    lng_bits = precision * 5 - lat_bits
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """ Method to return the (south, north, west, east) degrees of a box holding a circle around a point
+
+    west is greater than east when the box crosses the antimeridian, and the
+    box spans every longitude when it reaches a pole.
+    """
+    lat_radius = radius_km / KM_PER_DEGREE
+    south, north = max(latitude - lat_radius, -90.0), min(latitude + lat_radius, 90.0)
+    # A degree of longitude is shortest at the edge of the box closest to a pole
+    narrowest = min(math.cos(math.radians(south)), math.cos(math.radians(north)))
+    if narrowest <= 0 or radius_km / (KM_PER_DEGREE * narrowest) >= 180.0:
+        return south, north, -180.0, 180.0
+    lng_radius = radius_km / (KM_PER_DEGREE * narrowest)
+    return south, north, wrap_longitude(longitude - lng_radius), wrap_longitude(longitude + lng_radius)
+
+
+def wrap_longitude(longitude):
+    return (longitude + 180.0) % 360.0 - 180.0
+
+
+def covering_prefixes(latitude, longitude, radius_km, max_cells=MAX_COVERING_CELLS):
+    """ Method to return the geohash prefixes whose cells cover the bounding box of a circle around a point
+
+    The precision is the finest one that covers the box with at most max_cells
+    cells, so each index range scan reads little more than the box itself.
+    """
+    south, north, west, east = bounding_box(latitude, longitude, radius_km)
+
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        rows, columns = round(180.0 / height), round(360.0 / width)
+        first_row = min(int((south + 90.0) / height), rows - 1)
+        last_row = min(int((north + 90.0) / height), rows - 1)
+        first_column = min(int((west + 180.0) / width), columns - 1)
+        last_column = min(int((east + 180.0) / width), columns - 1)
+        if west > east:
+            last_column += columns
+        if (last_row - first_row + 1) * (last_column - first_column + 1) <= max_cells or precision == 1:
+            break
+
+    # Each cell is encoded from its centre
+    return sorted({
+        encode(-90.0 + (row + 0.5) * height, -180.0 + (column % columns + 0.5) * width, precision)
+        for row in range(first_row, last_row + 1) for column in range(first_column, last_column + 1)
+    })
+
+
+def distance_km(lat1, lng1, lat2, lng2):
+    """ Method to compute the great circle distance between two points """
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
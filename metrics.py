@@ -0,0 +1,248 @@
+import glob
+import json
+import os
+import threading
+import time
+import weakref
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metrics:
+    """ Prometheus style counters, gauges and histograms
+
+    Every thread writes to its own shard, so recording a sample takes no lock;
+    shards are only summed when the metrics are collected. When a thread exits
+    its shard is folded into the retired totals, so the number of shards stays
+    at the number of live threads. With a directory set, each worker process
+    also dumps its totals there and a scrape of any worker merges the files of
+    all of them. The counters and histograms of workers that have exited are
+    folded into one archive file and their files deleted, so a scrape reads
+    one file per live worker plus the archive.
+    """
+
+    def __init__(self, directory=None, dump_interval=1.0):
+        self.directory = directory
+        self.dump_interval = dump_interval
+        self.last_dump = 0.0
+        # Process that last wrote its file, differs from the current one in a new worker
+        self.dumped_pid = None
+        self.local = threading.local()
+        self.shards = {}
+        self.retired = defaultdict(float)
+        # Reentrant since a garbage collection run inside a locked section can retire a shard
+        self.shards_lock = threading.RLock()
+        self.types = {}
+        self.gauge_callbacks = []
+
+    def shard(self):
+        try:
+            return self.local.values
+        except AttributeError:
+            values = self.local.values = defaultdict(float)
+            # The thread local owner is released when the thread exits, which retires its shard
+            owner = self.local.owner = ShardOwner()
+            with self.shards_lock:
+                self.shards[id(owner)] = values
+            weakref.finalize(owner, self.retire, id(owner))
+            return values
+
+    def retire(self, owner_id):
+        """ Method to fold the shard of a thread that has exited into the retired totals """
+        with self.shards_lock:
+            values = self.shards.pop(owner_id, None)
+            for key, value in (values or {}).items():
+                self.retired[key] += value
+
+    def inc(self, name, labels=(), value=1, kind='counter'):
+        """ Method to add value to a counter, or to a gauge when kind is 'gauge' """
+        self.types.setdefault(name, kind)
+        self.shard()[(name, labels)] += value
+
+    def observe(self, name, labels, value, buckets=LATENCY_BUCKETS):
+        """ Method to record a sample in a histogram """
+        self.types.setdefault(name, 'histogram')
+        values = self.shard()
+        # Buckets are stored per interval here and made cumulative when rendered
+        le = buckets[bisect_left(buckets, value)] if value <= buckets[-1] else '+Inf'
+        values[(name + '_bucket', labels + (('le', str(le)),))] += 1
+        values[(name + '_sum', labels)] += value
+        values[(name + '_count', labels)] += 1
+
+    def gauge(self, callback):
+        """ Method to register a callback returning {(name, labels): value} gauges read at collection time """
+        self.gauge_callbacks.append(callback)
+
+    def collect(self):
+        """ Method to return this process's totals """
+        with self.shards_lock:
+            totals = defaultdict(float, self.retired)
+            shards = list(self.shards.values())
+        for values in shards:
+            for key, value in list(values.items()):
+                totals[key] += value
+        for callback in self.gauge_callbacks:
+            for (name, labels), value in callback().items():
+                self.types.setdefault(name, 'gauge')
+                totals[(name, labels)] += value
+        return totals
+
+    def file_path(self, pid):
+        return os.path.join(self.directory, f'metrics-{pid}.json')
+
+    def archive_path(self):
+        return os.path.join(self.directory, 'metrics-archive.json')
+
+    def worker_files(self):
+        return [path for path in glob.glob(os.path.join(self.directory, 'metrics-*.json'))
+                if path != self.archive_path()]
+
+    @contextmanager
+    def directory_lock(self):
+        """ Method to hold an exclusive lock on the metrics directory, shared by every worker process """
+        # fcntl is Unix only, as are the multi-process servers that set a directory
+        import fcntl
+        with open(os.path.join(self.directory, 'metrics.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def dump(self, force=False):
+        """ Method to write this process's totals to the shared directory, at most once per dump_interval """
+        now = time.monotonic()
+        if not self.directory or (not force and now - self.last_dump < self.dump_interval):
+            return
+        self.last_dump = now
+
+        path = self.file_path(os.getpid())
+        # A file already there was left by an exited worker that had the same pid
+        if self.dumped_pid != os.getpid():
+            with self.directory_lock():
+                self.archive([path])
+            self.dumped_pid = os.getpid()
+
+        write_snapshot(path, {
+            "types": self.types,
+            "values": [[name, list(labels), value] for (name, labels), value in self.collect().items()]
+        })
+
+    def archive(self, paths):
+        """ Method to fold the counters and histograms of exited workers into the archive file, deleting their files
+
+        Their gauges are dropped since nothing holds them any more. Called with
+        the directory lock held.
+        """
+        snapshots = [(path, read_snapshot(path)) for path in paths if os.path.exists(path)]
+        snapshots = [(path, snapshot) for path, snapshot in snapshots if snapshot is not None]
+        if not snapshots:
+            return
+
+        archive = read_snapshot(self.archive_path()) or {"types": {}, "values": []}
+        totals = defaultdict(float)
+        for name, labels, value in archive['values']:
+            totals[(name, tuple(tuple(label) for label in labels))] += value
+        for _, snapshot in snapshots:
+            for name, kind in snapshot['types'].items():
+                archive['types'].setdefault(name, kind)
+            for name, labels, value in snapshot['values']:
+                if snapshot['types'].get(name) != 'gauge':
+                    totals[(name, tuple(tuple(label) for label in labels))] += value
+
+        write_snapshot(self.archive_path(), {
+            "types": archive['types'],
+            "values": [[name, [list(label) for label in labels], value] for (name, labels), value in totals.items()]
+        })
+        for path, _ in snapshots:
+            os.remove(path)
+
+    def merged(self):
+        """ Method to sum the totals of every worker process
+
+        Files of workers that have exited are archived first. Reading happens
+        under the directory lock, so a file is never counted both on its own
+        and in the archive.
+        """
+        if not self.directory:
+            return self.collect()
+
+        self.dump(force=True)
+        totals = defaultdict(float)
+        with self.directory_lock():
+            self.archive([path for path in self.worker_files()
+                          if not process_alive(int(os.path.basename(path)[len('metrics-'):-len('.json')]))])
+            for path in self.worker_files() + [self.archive_path()]:
+                snapshot = read_snapshot(path)
+                if snapshot is None:
+                    continue
+                for name, kind in snapshot['types'].items():
+                    self.types.setdefault(name, kind)
+                for name, labels, value in snapshot['values']:
+                    totals[(name, tuple(tuple(label) for label in labels))] += value
+        return totals
+
+    def render(self):
+        """ Method to render all metrics in the Prometheus text format """
+        totals = self.merged()
+        lines = []
+
+        for name in sorted(self.types):
+            lines.append(f'# TYPE {name} {self.types[name]}')
+            if self.types[name] == 'histogram':
+                lines += self.render_histogram(name, totals)
+            else:
+                lines += [format_sample(name, labels, value)
+                          for (sample, labels), value in sorted(totals.items()) if sample == name]
+
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def render_histogram(name, totals):
+        lines = []
+        series = sorted({labels for (sample, labels) in totals if sample == name + '_count'})
+        for labels in series:
+            cumulative = 0
+            for le in [str(bucket) for bucket in LATENCY_BUCKETS] + ['+Inf']:
+                cumulative += totals.get((name + '_bucket', labels + (('le', le),)), 0)
+                lines.append(format_sample(name + '_bucket', labels + (('le', le),), cumulative))
+            lines.append(format_sample(name + '_sum', labels, totals[(name + '_sum', labels)]))
+            lines.append(format_sample(name + '_count', labels, totals[(name + '_count', labels)]))
+        return lines
+
+
+class ShardOwner:
+    """ Placeholder kept in a thread's locals, weakly referenced to notice the thread exiting """
+
+
+def read_snapshot(path):
+    try:
+        with open(path) as dump_file:
+            return json.load(dump_file)
+    except (OSError, ValueError):
+        return None
+
+
+def write_snapshot(path, snapshot):
+    # Written aside and renamed, so readers never see a partial file
+    with open(path + '.tmp', 'w') as dump_file:
+        json.dump(snapshot, dump_file)
+    os.replace(path + '.tmp', path)
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def format_sample(name, labels, value):
+    if labels:
+        escaped = ','.join('{}="{}"'.format(key, str(label).replace('\\', '\\\\').replace('"', '\\"'))
+                           for key, label in labels)
+        name = f'{name}{{{escaped}}}'
+    return f'{name} {value:g}' if isinstance(value, float) else f'{name} {value}'
@@ -0,0 +1,68 @@
+"""baseline schema
+
+Databases created before migrations were tracked already have these tables;
+mark them with `flask db stamp 1f2a9c6d4b70` instead of upgrading.
+
+Revision ID: 1f2a9c6d4b70
+Revises:
+Create Date: 2026-10-19 00:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from db_types import StringArray
+
+
+# revision identifiers, used by Alembic.
+revision = '1f2a9c6d4b70'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'venues',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('city', sa.String(length=120), nullable=False),
+        sa.Column('state', sa.String(length=120), nullable=False),
+        sa.Column('address', sa.String(length=120), nullable=False),
+        sa.Column('phone', sa.String(length=120), nullable=True),
+        sa.Column('image_link', sa.String(length=500), nullable=True),
+        sa.Column('genres', StringArray(), nullable=False),
+        sa.Column('facebook_link', sa.String(length=120), nullable=True),
+        sa.Column('website', sa.String(length=250), nullable=True),
+        sa.Column('seeking_talent', sa.Boolean(), nullable=True),
+        sa.Column('seeking_description', sa.String(length=250), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table(
+        'artists',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('city', sa.String(length=120), nullable=False),
+        sa.Column('state', sa.String(length=120), nullable=False),
+        sa.Column('phone', sa.String(length=120), nullable=True),
+        sa.Column('genres', StringArray(), nullable=False),
+        sa.Column('image_link', sa.String(length=500), nullable=True),
+        sa.Column('facebook_link', sa.String(length=120), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    # Foreign keys carry the names Postgres gives them, so later revisions can drop them on any backend
+    op.create_table(
+        'shows',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('artist_id', sa.Integer(), nullable=False),
+        sa.Column('venue_id', sa.Integer(), nullable=False),
+        sa.Column('start_time', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['artist_id'], ['artists.id'], name='shows_artist_id_fkey'),
+        sa.ForeignKeyConstraint(['venue_id'], ['venues.id'], name='shows_venue_id_fkey'),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('shows')
+    op.drop_table('artists')
+    op.drop_table('venues')
@@ -0,0 +1,83 @@
+"""show end times, booking indexes and overlap constraints
+
+On PostgreSQL the end times are backfilled in batches of committed updates,
+the NOT NULL rule is proven by a validated check constraint instead of a table
+scan under lock, and the indexes are built concurrently. The exclusion
+constraints cannot be built concurrently: each holds an exclusive lock on
+shows while its GiST index builds, so run this revision off-peak. They fail to
+build while overlapping shows exist, so resolve double bookings first.
+
+Revision ID: 3b9f1e6a2d58
+Revises: 1f2a9c6d4b70
+Create Date: 2026-10-19 00:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b9f1e6a2d58'
+down_revision = '1f2a9c6d4b70'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 5000
+LOCK_TIMEOUT = '5s'
+
+
+def backfill_end_times(postgres):
+    """ Method to give every show a two hour end time, one committed id range at a time """
+    end_time = "start_time + interval '2 hours'" if postgres else "datetime(start_time, '+2 hours')"
+    update = sa.text(f'UPDATE shows SET end_time = {end_time} '
+                     'WHERE id >= :low AND id < :high AND end_time IS NULL')
+    bind = op.get_bind()
+    low, high = bind.execute('SELECT min(id), max(id) FROM shows').first()
+    for start in range(low or 0, (high or 0) + 1, BATCH_SIZE):
+        bind.execute(update, low=start, high=start + BATCH_SIZE)
+    # Shows booked by the previous release while the batches ran
+    op.execute(f'UPDATE shows SET end_time = {end_time} WHERE end_time IS NULL')
+
+
+def upgrade():
+    postgres = op.get_bind().dialect.name == 'postgresql'
+
+    if postgres:
+        op.execute(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'")
+    op.add_column('shows', sa.Column('end_time', sa.DateTime(), nullable=True))
+
+    with op.get_context().autocommit_block():
+        backfill_end_times(postgres)
+        if postgres:
+            op.execute('ALTER TABLE shows ADD CONSTRAINT shows_end_time_not_null '
+                       'CHECK (end_time IS NOT NULL) NOT VALID')
+            op.execute('ALTER TABLE shows VALIDATE CONSTRAINT shows_end_time_not_null')
+        op.create_index('ix_shows_venue_id_start_time', 'shows', ['venue_id', 'start_time'],
+                        postgresql_concurrently=True)
+        op.create_index('ix_shows_artist_id_start_time', 'shows', ['artist_id', 'start_time'],
+                        postgresql_concurrently=True)
+
+    if postgres:
+        # PostgreSQL 12+ skips the table scan when a valid check already proves the column
+        op.execute(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'")
+        op.execute('ALTER TABLE shows ALTER COLUMN end_time SET NOT NULL')
+        op.execute('ALTER TABLE shows DROP CONSTRAINT shows_end_time_not_null')
+        op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+        for resource in ('venue_id', 'artist_id'):
+            op.execute(f'ALTER TABLE shows ADD CONSTRAINT shows_{resource}_no_overlap '
+                       f'EXCLUDE USING gist ({resource} WITH =, tsrange(start_time, end_time) WITH &&)')
+    else:
+        with op.batch_alter_table('shows') as batch_op:
+            batch_op.alter_column('end_time', existing_type=sa.DateTime(), nullable=False)
+
+
+def downgrade():
+    postgres = op.get_bind().dialect.name == 'postgresql'
+
+    if postgres:
+        for resource in ('venue_id', 'artist_id'):
+            op.execute(f'ALTER TABLE shows DROP CONSTRAINT shows_{resource}_no_overlap')
+    op.drop_index('ix_shows_artist_id_start_time', table_name='shows')
+    op.drop_index('ix_shows_venue_id_start_time', table_name='shows')
+    with op.batch_alter_table('shows') as batch_op:
+        batch_op.drop_column('end_time')
@@ -0,0 +1,25 @@
+"""shows start time index for date range browsing
+
+Revision ID: 5a7c2e9d1f43
+Revises: 3b9f1e6a2d58
+Create Date: 2026-10-19 00:31:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a7c2e9d1f43'
+down_revision = '3b9f1e6a2d58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.create_index('ix_shows_start_time', 'shows', ['start_time'], postgresql_concurrently=True)
+
+
+def downgrade():
+    op.drop_index('ix_shows_start_time', table_name='shows')
@@ -0,0 +1,39 @@
+"""venue coordinates and geohash index for the near search
+
+Revision ID: 6e2d4a8c0b71
+Revises: 5a7c2e9d1f43
+Create Date: 2026-10-19 00:32:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6e2d4a8c0b71'
+down_revision = '5a7c2e9d1f43'
+branch_labels = None
+depends_on = None
+
+LOCK_TIMEOUT = '5s'
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'")
+    with op.batch_alter_table('venues') as batch_op:
+        batch_op.add_column(sa.Column('latitude', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('longitude', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('geohash', sa.String(length=9), nullable=True))
+
+    with op.get_context().autocommit_block():
+        op.create_index('ix_venues_geohash', 'venues', ['geohash'],
+                        postgresql_ops={'geohash': 'text_pattern_ops'}, postgresql_concurrently=True)
+
+
+def downgrade():
+    op.drop_index('ix_venues_geohash', table_name='venues')
+    with op.batch_alter_table('venues') as batch_op:
+        batch_op.drop_column('geohash')
+        batch_op.drop_column('longitude')
+        batch_op.drop_column('latitude')
@@ -0,0 +1,59 @@
+"""precomputed recommendations and job watermarks
+
+Revision ID: 7f4b1c3e9a26
+Revises: 6e2d4a8c0b71
+Create Date: 2026-10-19 00:33:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7f4b1c3e9a26'
+down_revision = '6e2d4a8c0b71'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'venue_similarities',
+        sa.Column('venue_id', sa.Integer(), nullable=False),
+        sa.Column('similar_venue_id', sa.Integer(), nullable=False),
+        sa.Column('score', sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(['venue_id'], ['venues.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['similar_venue_id'], ['venues.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('venue_id', 'similar_venue_id')
+    )
+    op.create_table(
+        'artist_similarities',
+        sa.Column('artist_id', sa.Integer(), nullable=False),
+        sa.Column('similar_artist_id', sa.Integer(), nullable=False),
+        sa.Column('score', sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(['artist_id'], ['artists.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['similar_artist_id'], ['artists.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('artist_id', 'similar_artist_id')
+    )
+    op.create_table(
+        'recommended_versions',
+        sa.Column('kind', sa.String(length=20), nullable=False),
+        sa.Column('entity_id', sa.Integer(), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('show_count', sa.Integer(), nullable=False),
+        sa.Column('show_id_sum', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('kind', 'entity_id')
+    )
+    op.create_table(
+        'watermarks',
+        sa.Column('name', sa.String(length=120), nullable=False),
+        sa.Column('value', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('watermarks')
+    op.drop_table('recommended_versions')
+    op.drop_table('artist_similarities')
+    op.drop_table('venue_similarities')
@@ -0,0 +1,67 @@
+"""genre join tables
+
+The legacy genres arrays become nullable, since venues and artists are now
+saved through the genre join tables. Run `flask backfill-genres` afterwards to
+copy the existing arrays into them.
+
+Revision ID: 8d3e5b7a2c14
+Revises: a8d6f2c4e015
+Create Date: 2026-10-19 00:36:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from db_types import StringArray
+
+
+# revision identifiers, used by Alembic.
+revision = '8d3e5b7a2c14'
+down_revision = 'a8d6f2c4e015'
+branch_labels = None
+depends_on = None
+
+LOCK_TIMEOUT = '5s'
+
+
+def upgrade():
+    op.create_table(
+        'venue_genres',
+        sa.Column('venue_id', sa.Integer(), nullable=False),
+        sa.Column('genre_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['venue_id'], ['venues.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['genre_id'], ['genres.id']),
+        sa.PrimaryKeyConstraint('venue_id', 'genre_id')
+    )
+    op.create_index('ix_venue_genres_genre_id', 'venue_genres', ['genre_id'])
+    op.create_table(
+        'artist_genres',
+        sa.Column('artist_id', sa.Integer(), nullable=False),
+        sa.Column('genre_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['artist_id'], ['artists.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['genre_id'], ['genres.id']),
+        sa.PrimaryKeyConstraint('artist_id', 'genre_id')
+    )
+    op.create_index('ix_artist_genres_genre_id', 'artist_genres', ['genre_id'])
+
+    # Dropping NOT NULL only changes the catalog on PostgreSQL
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'")
+    for table in ('venues', 'artists'):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column('genres', existing_type=StringArray(), nullable=True)
+
+
+def downgrade():
+    postgres = op.get_bind().dialect.name == 'postgresql'
+
+    # Rows saved without an array get an empty one back before the column is required again
+    empty = "ARRAY[]::varchar[]" if postgres else "'[]'"
+    for table in ('artists', 'venues'):
+        op.execute(f'UPDATE {table} SET genres = {empty} WHERE genres IS NULL')
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column('genres', existing_type=StringArray(), nullable=False)
+
+    op.drop_index('ix_artist_genres_genre_id', table_name='artist_genres')
+    op.drop_table('artist_genres')
+    op.drop_index('ix_venue_genres_genre_id', table_name='venue_genres')
+    op.drop_table('venue_genres')
@@ -0,0 +1,60 @@
+"""soft deleted venues and artists and cascading show deletes
+
+On PostgreSQL the cascading foreign keys are added as NOT VALID and validated
+without blocking writes, then swapped in for the old ones.
+
+Revision ID: 9c0e5d2b7f18
+Revises: 7f4b1c3e9a26
+Create Date: 2026-10-19 00:34:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c0e5d2b7f18'
+down_revision = '7f4b1c3e9a26'
+branch_labels = None
+depends_on = None
+
+LOCK_TIMEOUT = '5s'
+REFERENCES = (('venue_id', 'venues'), ('artist_id', 'artists'))
+
+
+def upgrade():
+    postgres = op.get_bind().dialect.name == 'postgresql'
+
+    if postgres:
+        op.execute(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'")
+    for table in ('venues', 'artists'):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.add_column(sa.Column('deleted_at', sa.DateTime(), nullable=True))
+
+    if not postgres:
+        with op.batch_alter_table('shows') as batch_op:
+            for column, referred in REFERENCES:
+                batch_op.drop_constraint(f'shows_{column}_fkey', type_='foreignkey')
+                batch_op.create_foreign_key(f'shows_{column}_fkey', referred, [column], ['id'], ondelete='CASCADE')
+        return
+
+    for column, referred in REFERENCES:
+        op.execute(f'ALTER TABLE shows ADD CONSTRAINT shows_{column}_fkey_cascade FOREIGN KEY ({column}) '
+                   f'REFERENCES {referred} (id) ON DELETE CASCADE NOT VALID')
+    with op.get_context().autocommit_block():
+        for column, referred in REFERENCES:
+            op.execute(f'ALTER TABLE shows VALIDATE CONSTRAINT shows_{column}_fkey_cascade')
+    op.execute(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'")
+    for column, referred in REFERENCES:
+        op.execute(f'ALTER TABLE shows DROP CONSTRAINT shows_{column}_fkey')
+        op.execute(f'ALTER TABLE shows RENAME CONSTRAINT shows_{column}_fkey_cascade TO shows_{column}_fkey')
+
+
+def downgrade():
+    with op.batch_alter_table('shows') as batch_op:
+        for column, referred in REFERENCES:
+            batch_op.drop_constraint(f'shows_{column}_fkey', type_='foreignkey')
+            batch_op.create_foreign_key(f'shows_{column}_fkey', referred, [column], ['id'])
+    for table in ('artists', 'venues'):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('deleted_at')
@@ -0,0 +1,39 @@
+"""state and genre vocabulary tables, seeded with the built in lists
+
+Revision ID: a8d6f2c4e015
+Revises: 9c0e5d2b7f18
+Create Date: 2026-10-19 00:35:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from vocabulary import DEFAULT_STATES, DEFAULT_GENRES
+
+
+# revision identifiers, used by Alembic.
+revision = 'a8d6f2c4e015'
+down_revision = '9c0e5d2b7f18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    states = op.create_table(
+        'states',
+        sa.Column('code', sa.String(length=2), nullable=False),
+        sa.PrimaryKeyConstraint('code')
+    )
+    genres = op.create_table(
+        'genres',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=120), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name')
+    )
+    op.bulk_insert(states, [{'code': code} for code in DEFAULT_STATES])
+    op.bulk_insert(genres, [{'name': name} for name in DEFAULT_GENRES])
+
+
+def downgrade():
+    op.drop_table('genres')
+    op.drop_table('states')
@@ -0,0 +1,57 @@
+"""daily show rollups
+
+Revision ID: c47e1d9a6f35
+Revises: 8d3e5b7a2c14
+Create Date: 2026-10-19 00:45:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c47e1d9a6f35'
+down_revision = '8d3e5b7a2c14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'show_rollups',
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('dimension', sa.String(length=20), nullable=False),
+        sa.Column('key', sa.String(length=250), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('day', 'dimension', 'key')
+    )
+    op.create_index('ix_show_rollups_dimension_day', 'show_rollups', ['dimension', 'day'])
+    op.create_table(
+        'show_rollup_totals',
+        sa.Column('dimension', sa.String(length=20), nullable=False),
+        sa.Column('key', sa.String(length=250), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('dimension', 'key')
+    )
+    op.create_index('ix_show_rollup_totals_dimension_count', 'show_rollup_totals', ['dimension', 'count'])
+    # An unbuilt window, so refresh-rollups and purge-deleted always have a row to lock
+    op.bulk_insert(sa.table('watermarks', sa.column('name'), sa.column('value')),
+                   [{'name': 'rollup_window', 'value': 0}])
+    op.create_table(
+        'rolled_up_shows',
+        sa.Column('show_id', sa.Integer(), nullable=False),
+        sa.Column('dimension', sa.String(length=20), nullable=False),
+        sa.Column('key', sa.String(length=250), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.ForeignKeyConstraint(['show_id'], ['shows.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('show_id', 'dimension', 'key')
+    )
+
+
+def downgrade():
+    op.drop_table('rolled_up_shows')
+    op.execute("DELETE FROM watermarks WHERE name = 'rollup_window'")
+    op.drop_index('ix_show_rollup_totals_dimension_count', table_name='show_rollup_totals')
+    op.drop_table('show_rollup_totals')
+    op.drop_index('ix_show_rollups_dimension_day', table_name='show_rollups')
+    op.drop_table('show_rollups')
@@ -0,0 +1,39 @@
+"""idempotency keys and venue and artist row versions
+
+Revision ID: e5f80b2d7c93
+Revises: c47e1d9a6f35
+Create Date: 2026-10-19 01:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5f80b2d7c93'
+down_revision = 'c47e1d9a6f35'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'idempotency_keys',
+        sa.Column('key', sa.String(length=64), nullable=False),
+        sa.Column('endpoint', sa.String(length=120), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('key')
+    )
+    op.create_index('ix_idempotency_keys_created_at', 'idempotency_keys', ['created_at'])
+    # The server default fills existing rows without rewriting them one by one
+    op.add_column('venues', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    op.add_column('artists', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('artists') as batch_op:
+        batch_op.drop_column('version')
+    with op.batch_alter_table('venues') as batch_op:
+        batch_op.drop_column('version')
+    op.drop_index('ix_idempotency_keys_created_at', table_name='idempotency_keys')
+    op.drop_table('idempotency_keys')
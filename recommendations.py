@@ -0,0 +1,107 @@
+import numpy as np
+from scipy import sparse
+
+TOP_K = 5
+GENRE_WEIGHT = 0.5
+# Upper bound on similarity scores held in memory per chunk of rows
+CHUNK_CELLS = 2 ** 24
+
+
+def normalize_rows(matrix):
+    """ Method to scale every row of a sparse matrix to unit length """
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    inverse = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    return sparse.diags(inverse) @ matrix
+
+
+def one_hot(index, pairs):
+    """ Method to build a sparse entity x value matrix from (entity_id, value) pairs, repeated pairs add up """
+    columns = {}
+    rows, cols = [], []
+    for entity_id, value in pairs:
+        rows.append(index[entity_id])
+        cols.append(columns.setdefault(value, len(columns)))
+    return sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(index), max(len(columns), 1)))
+
+
+def build_features(entity_ids, genres_by_entity, bookings):
+    """ Method to build unit length feature rows from genres and co-bookings
+
+    genres_by_entity maps an entity id to its genres, bookings is a list of
+    (entity_id, partner_id) pairs taken from the shows table. A dot product of
+    two rows is then the weighted sum of their genre and co-booking cosines.
+    """
+    index = {entity_id: position for position, entity_id in enumerate(entity_ids)}
+    genre_matrix = one_hot(index, ((entity_id, genre) for entity_id, genres in genres_by_entity.items()
+                                   for genre in genres or ()))
+    booking_matrix = one_hot(index, bookings)
+
+    return sparse.hstack([
+        normalize_rows(genre_matrix) * np.sqrt(GENRE_WEIGHT),
+        normalize_rows(booking_matrix) * np.sqrt(1 - GENRE_WEIGHT)
+    ]).tocsr()
+
+
+def top_similar(entity_ids, features, targets, k=TOP_K):
+    """ Method to find the k most similar entities for each target id
+
+    Scores are computed a chunk of rows at a time against the whole matrix,
+    so memory stays bounded by CHUNK_CELLS. Equal scores rank by id, so the
+    lists do not depend on the order of entity_ids. Returns
+    {target_id: [(other_id, score)]}.
+    """
+    ids = np.asarray(entity_ids)
+    index = {entity_id: position for position, entity_id in enumerate(entity_ids)}
+    rows = np.asarray([index[target] for target in targets], dtype=np.int64)
+    results = {}
+
+    if len(ids) < 2 or len(rows) == 0:
+        return {target: [] for target in targets}
+
+    k = min(k, len(ids) - 1)
+    chunk = max(1, CHUNK_CELLS // len(ids))
+    transposed = features.T.tocsc()
+
+    for start in range(0, len(rows), chunk):
+        block = rows[start:start + chunk]
+        scores = (features[block] @ transposed).toarray()
+        # An entity is never its own recommendation
+        scores[np.arange(len(block)), block] = 0
+
+        kth = -np.partition(-scores, k - 1, axis=1)[:, k - 1]
+        for position, row in enumerate(block):
+            # Everything tied with the k-th score is a candidate, ties are then broken by id rather than position
+            candidates = np.nonzero((scores[position] >= kth[position]) & (scores[position] > 0))[0]
+            ranked = candidates[np.lexsort((ids[candidates], -scores[position, candidates]))][:k]
+            results[ids[row].item()] = [(ids[column].item(), float(scores[position, column])) for column in ranked]
+
+    return results
+
+
+def entering_neighbours(entity_ids, features, changed, thresholds):
+    """ Method to find the entities whose top k list a changed entity can now enter
+
+    thresholds holds, in entity_ids order, the score of each entity's current
+    k-th neighbour, or 0 when it has fewer than k. A changed entity scoring at
+    least that against it can take a place in its list. Scores are computed in
+    chunks of rows as in top_similar. Returns a set of entity ids.
+    """
+    ids = np.asarray(entity_ids)
+    index = {entity_id: position for position, entity_id in enumerate(entity_ids)}
+    rows = np.asarray([index[entity_id] for entity_id in changed], dtype=np.int64)
+    found = set()
+
+    if len(ids) < 2 or len(rows) == 0:
+        return found
+
+    chunk = max(1, CHUNK_CELLS // len(ids))
+    transposed = features.T.tocsc()
+    for start in range(0, len(rows), chunk):
+        block = rows[start:start + chunk]
+        scores = (features[block] @ transposed).toarray()
+        scores[np.arange(len(block)), block] = 0
+        # Scores of stored neighbours were computed the same way, the tolerance only absorbs rounding
+        entering = (scores > 0) & (scores >= np.asarray(thresholds) - 1e-9)
+        found.update(ids[np.nonzero(entering.any(axis=0))[0]].tolist())
+
+    return found
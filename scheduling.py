@@ -0,0 +1,87 @@
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import timedelta
+from itertools import accumulate
+
+DEFAULT_SHOW_DURATION = timedelta(hours=2)
+# Longest show that can be booked. A show overlapping [start, end) then has to start after
+# start - MAX_SHOW_DURATION, which bounds conflict checks to a short range of the start_time index.
+MAX_SHOW_DURATION = timedelta(hours=24)
+
+
+class BookingCalendar:
+    """ Read only interval index of the existing bookings of a single venue or artist
+
+    Bookings are sorted once when the calendar is built. Next to every start
+    it keeps the latest end of all bookings up to it, so a conflict check is
+    one binary search even when older data holds overlapping bookings.
+    """
+
+    def __init__(self, intervals=()):
+        self.intervals = sorted(intervals, key=lambda interval: interval[0])
+        self.starts = [start for start, _, _ in self.intervals]
+        self.latest_ends = list(accumulate((end for _, end, _ in self.intervals), max))
+
+    def conflict(self, start, end):
+        """ Method to return a booking overlapping [start, end), if any """
+        position = bisect_left(self.starts, start)
+
+        # Some booking starting before the new one overlaps when the latest of their ends is after the new start
+        if position > 0 and self.latest_ends[position - 1] > start:
+            position = bisect_right(self.latest_ends, start, 0, position)
+            return self.intervals[position]
+
+        # Next booking overlaps when it begins before the new end
+        if position < len(self.intervals) and self.intervals[position][0] < end:
+            return self.intervals[position]
+
+        return None
+
+
+def find_conflicts(shows, existing=()):
+    """ Method to validate a batch of shows against each other and against shows already booked
+
+    Both are (key, artist_id, venue_id, start_time, end_time) tuples. Existing
+    shows go into a BookingCalendar per venue and artist. The batch is swept in
+    start time order; accepted shows never overlap, so only the last one
+    accepted for a venue or artist can clash with the next. The whole check
+    is O(n log n). Returns (key, conflicting_key, reason) tuples for every
+    rejected show.
+    """
+    venue_bookings = defaultdict(list)
+    artist_bookings = defaultdict(list)
+    for key, artist_id, venue_id, start_time, end_time in existing:
+        venue_bookings[venue_id].append((start_time, end_time, key))
+        artist_bookings[artist_id].append((start_time, end_time, key))
+    venue_calendars = {venue_id: BookingCalendar(bookings) for venue_id, bookings in venue_bookings.items()}
+    artist_calendars = {artist_id: BookingCalendar(bookings) for artist_id, bookings in artist_bookings.items()}
+    empty = BookingCalendar()
+
+    last_venue_booking = {}
+    last_artist_booking = {}
+    conflicts = []
+
+    for key, artist_id, venue_id, start_time, end_time in sorted(shows, key=lambda show: show[3]):
+        clash = venue_calendars.get(venue_id, empty).conflict(start_time, end_time)
+        if clash is not None:
+            conflicts.append((key, clash[2], 'venue'))
+            continue
+
+        clash = artist_calendars.get(artist_id, empty).conflict(start_time, end_time)
+        if clash is not None:
+            conflicts.append((key, clash[2], 'artist'))
+            continue
+
+        last = last_venue_booking.get(venue_id)
+        if last is not None and last[1] > start_time:
+            conflicts.append((key, last[2], 'venue'))
+            continue
+
+        last = last_artist_booking.get(artist_id)
+        if last is not None and last[1] > start_time:
+            conflicts.append((key, last[2], 'artist'))
+            continue
+
+        last_venue_booking[venue_id] = last_artist_booking[artist_id] = (start_time, end_time, key)
+
+    return conflicts
@@ -0,0 +1,112 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from flask import g, has_app_context, has_request_context, request
+from flask.logging import default_handler
+
+# Attributes passed with extra= that end up as fields of the JSON record
+EXTRA_FIELDS = ('route', 'method', 'status', 'duration_ms', 'query_count')
+
+
+class JsonFormatter(logging.Formatter):
+    """ Formats records as one JSON object per line """
+
+    def format(self, record):
+        entry = {
+            "time": datetime.utcfromtimestamp(record.created).isoformat() + 'Z',
+            "level": record.levelname,
+            "message": record.getMessage(),
+            "logger": record.name,
+            "pid": record.process,
+            "request_id": getattr(record, 'request_id', None),
+        }
+        for field in EXTRA_FIELDS:
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            # Records that crossed the queue carry the traceback as text
+            entry["exception"] = record.exc_text
+        return json.dumps(entry)
+
+
+class MessageFormatter(logging.Formatter):
+    """ Formats only the message, leaving the traceback in exc_text instead of appending it """
+
+    def format(self, record):
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        return record.getMessage()
+
+
+class TracebackQueueHandler(QueueHandler):
+    """ Queue handler that keeps the formatted traceback on the queued record
+
+    The stock prepare() drops exc_info and exc_text because they may not
+    pickle; the text is a plain string, so it is put back for the listener.
+    """
+
+    def prepare(self, record):
+        prepared = super().prepare(record)
+        prepared.exc_text = record.exc_text
+        return prepared
+
+
+class RequestContextFilter(logging.Filter):
+    """ Stamps records with the id of the request being handled """
+
+    def filter(self, record):
+        if not hasattr(record, 'request_id'):
+            record.request_id = g.get('request_id') if has_app_context() else None
+        if not hasattr(record, 'route') and has_request_context() and request.url_rule is not None:
+            record.route = request.url_rule.rule
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """ Keeps a fraction of records below WARNING, warnings and errors always pass """
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or self.rate >= 1 or random.random() < self.rate
+
+
+def configure_logging(app):
+    """ Method to send app logs through a queue to a background thread writing JSON lines
+
+    The request thread only puts the record on an in-memory queue. Formatting
+    and disk I/O happen on the listener thread, which is the only writer. Use {pid} in LOG_FILE to give
+    every worker process its own file.
+    """
+    file_handler = RotatingFileHandler(app.config['LOG_FILE'].format(pid=os.getpid()),
+                                       maxBytes=app.config['LOG_MAX_BYTES'],
+                                       backupCount=app.config['LOG_BACKUP_COUNT'])
+    file_handler.setFormatter(JsonFormatter())
+    file_handler.setLevel(logging.INFO)
+
+    log_queue = queue.Queue(-1)
+    queue_handler = TracebackQueueHandler(log_queue)
+    queue_handler.setFormatter(MessageFormatter())
+    # Filters run on the request thread, where the request context is still available
+    queue_handler.addFilter(SamplingFilter(app.config['LOG_SAMPLE_RATE']))
+    queue_handler.addFilter(RequestContextFilter())
+
+    app.logger.setLevel(logging.INFO)
+    # Flask's stderr handler would still write every record synchronously on the request thread
+    app.logger.removeHandler(default_handler)
+    app.logger.addHandler(queue_handler)
+
+    listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
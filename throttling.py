@@ -0,0 +1,152 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenBucketLimiter:
+    """ Token bucket rate limiter keyed by client, held in process memory """
+
+    def __init__(self, rate, capacity, max_clients=10000):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_clients = max_clients
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def allow(self, key):
+        """ Method to take one token for the client, returns False when it has none left """
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self.buckets[key] = (tokens, now)
+
+            if len(self.buckets) > self.max_clients:
+                self.prune(now)
+        return allowed
+
+    def prune(self, now):
+        # Buckets idle long enough to have refilled are the same as new ones
+        refill_time = self.capacity / self.rate
+        for key, (_, updated) in list(self.buckets.items()):
+            if now - updated >= refill_time:
+                del self.buckets[key]
+
+
+class TTLCache:
+    """ Small least recently used cache whose entries expire after ttl seconds """
+
+    def __init__(self, ttl, max_size=1024):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self.entries.pop(key, None)
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class SingleFlight:
+    """ Coalesces concurrent calls for the same key into one call whose result they all share """
+
+    class Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, function):
+        """ Method to run function once per key at a time, returns (result, shared) """
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = self.Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = function()
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result, False
+
+
+class SearchGuard:
+    """ Rate limit, coalesce and cache search queries, reporting what happened to each through record(event) """
+
+    def __init__(self, rate, capacity, ttl, record=lambda event: None):
+        self.limiter = TokenBucketLimiter(rate, capacity)
+        self.cache = TTLCache(ttl)
+        self.flight = SingleFlight()
+        self.record = record
+        # Bumped by invalidate(), a load started before a write must not be cached after it
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def allow(self, client):
+        allowed = self.limiter.allow(client)
+        self.record('allowed' if allowed else 'rejected')
+        return allowed
+
+    def invalidate(self):
+        """ Method to drop every cached result after the searched records change """
+        with self.lock:
+            self.generation += 1
+            self.cache.clear()
+
+    def search(self, key, loader):
+        """ Method to return cached results for key or load them, sharing one load between concurrent callers """
+        result = self.cache.get(key)
+        if result is not None:
+            self.record('cache_hits')
+            return result
+
+        self.record('cache_misses')
+        generation = self.generation
+        # Searches after a write start a new load instead of joining one that began before it
+        result, shared = self.flight.do((generation, key), loader)
+        if shared:
+            self.record('coalesced')
+            return result
+        with self.lock:
+            if generation == self.generation:
+                self.cache.set(key, result)
+        return result
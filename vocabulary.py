@@ -0,0 +1,82 @@
+import threading
+import time
+
+from markupsafe import Markup, escape
+
+DEFAULT_STATES = [
+    'AL', 'AK', 'AZ', 'AR', 'CA', 'CO', 'CT', 'DE', 'DC', 'FL', 'GA', 'HI', 'ID', 'IL', 'IN', 'IA', 'KS', 'KY',
+    'LA', 'ME', 'MT', 'NE', 'NV', 'NH', 'NJ', 'NM', 'NY', 'NC', 'ND', 'OH', 'OK', 'OR', 'MD', 'MA', 'MI', 'MN',
+    'MS', 'MO', 'PA', 'RI', 'SC', 'SD', 'TN', 'TX', 'UT', 'VT', 'VA', 'WA', 'WV', 'WI', 'WY',
+]
+
+DEFAULT_GENRES = [
+    'Alternative', 'Blues', 'Classical', 'Country', 'Electronic', 'Folk', 'Funk', 'Hip-Hop', 'Heavy Metal',
+    'Instrumental', 'Jazz', 'Musical Theatre', 'Pop', 'Punk', 'R&B', 'Reggae', 'Rock n Roll', 'Soul', 'Other',
+]
+
+
+class Vocabulary:
+    """ One immutable version of the state and genre lists, with everything forms need built up front """
+
+    def __init__(self, version, states, genres):
+        self.version = version
+        self.states = states
+        self.genres = genres
+        self.state_choices = [(state, state) for state in states]
+        self.genre_choices = [(genre, genre) for genre in genres]
+        # (unselected, selected) <option> markup for every value
+        self.state_options = self.build_options(states)
+        self.genre_options = self.build_options(genres)
+
+    @staticmethod
+    def build_options(values):
+        return [(value,
+                 f'<option value="{escape(value)}">{escape(value)}</option>',
+                 f'<option selected value="{escape(value)}">{escape(value)}</option>') for value in values]
+
+    @staticmethod
+    def render_options(options, selected):
+        """ Method to join precomputed <option> tags, marking the selected values """
+        selected = {selected} if isinstance(selected, str) else set(selected or ())
+        return Markup(''.join(chosen if value in selected else plain for value, plain, chosen in options))
+
+
+class VocabularyRegistry:
+    """ Process wide cache of the vocabulary tables
+
+    The tables are read again only when their version changes, and the
+    version itself is checked at most once every check_interval seconds.
+    """
+
+    def __init__(self):
+        self.current = Vocabulary(0, DEFAULT_STATES, DEFAULT_GENRES)
+        self.load = None
+        self.load_version = None
+        self.check_interval = 60
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+
+    def init_app(self, app, load, load_version):
+        """ Method to register how to read (states, genres) and the vocabulary version from the database """
+        self.load = load
+        self.load_version = load_version
+        self.check_interval = app.config['VOCABULARY_CHECK_INTERVAL']
+        self.checked_at = 0.0
+
+    def get(self):
+        """ Method to return the current vocabulary, reloading it if the tables changed """
+        if self.load is None or time.monotonic() - self.checked_at < self.check_interval:
+            return self.current
+
+        with self.lock:
+            if time.monotonic() - self.checked_at >= self.check_interval:
+                version = self.load_version()
+                if version != self.current.version:
+                    states, genres = self.load()
+                    # Empty tables fall back to the built in lists
+                    self.current = Vocabulary(version, states or DEFAULT_STATES, genres or DEFAULT_GENRES)
+                self.checked_at = time.monotonic()
+        return self.current
+
+
+registry = VocabularyRegistry()